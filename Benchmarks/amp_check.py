@@ -0,0 +1,78 @@
+""" Check of train(amp = True, channels_last = True) on cpu: a few epochs on synthetic data against the same run
+in float32. Asserts that the forward passes run under bfloat16 autocast with channels_last weights and that the
+train and test losses stay within --rtol of the float32 run, prints both runs and their times.
+Run from this folder: python amp_check.py [--epochs 2] [--samples 32] [--rtol 0.03]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Model import UNet
+from Dataloader import load_data
+from Trainer import train
+
+
+class Recorder(torch.nn.Module):
+    """ UNet that records the autocast state, the output dtype and the weight memory format of every forward """
+    def __init__(self):
+        super().__init__()
+        self.model = UNet()
+        self.calls = []
+
+    def forward(self, x):
+        out = self.model(x)
+        weight = self.model.encoder.enc_blocks[1].conv1.weight #unambiguous strides, unlike 1 channel or 1x1
+        self.calls.append((torch.is_autocast_enabled('cpu'), torch.get_autocast_dtype('cpu'), out.dtype,
+                           weight.is_contiguous(memory_format = torch.channels_last) and not weight.is_contiguous()))
+        return out
+
+
+def run(path, epochs, batch_size, **kwargs):
+    """ Losses, recorded forwards and time of one train() from a fixed seed, files go to a temporary folder """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            torch.manual_seed(0)
+            model = Recorder()
+            trainloader, testloader, _, _ = load_data(split = 0.25, batch_size = batch_size, device = 'cpu',
+                                                      path = path, fast = True)
+            t_0 = time.perf_counter()
+            train('cpu', epochs, False, testloader, trainloader, model = model, **kwargs)
+            elapsed = time.perf_counter()-t_0
+            losses = torch.load("losses_cpu.pt")
+        finally:
+            os.chdir(cwd)
+    return np.array(losses['TrainLoss']), np.array(losses['TestLoss']), model.calls, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type = int, default = 2)
+    parser.add_argument("--samples", type = int, default = 32)
+    parser.add_argument("--batch_size", type = int, default = 8)
+    parser.add_argument("--rtol", type = float, default = 0.03, help = "bfloat16 rounds to 2**-8 relative")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data:
+        rng = np.random.default_rng(0)
+        np.save(os.path.join(data, "input_images_10k.npy"), (rng.random((args.samples, 128, 128)) > 0.9)*1.0)
+        np.save(os.path.join(data, "target_images_10k.npy"), rng.random((args.samples, 128, 128)))
+        fp32 = run(data, args.epochs, args.batch_size)
+        bf16 = run(data, args.epochs, args.batch_size, amp = True, channels_last = True)
+
+    assert all(not enabled and dtype == torch.float32 and not cl for enabled, _, dtype, cl in fp32[2])
+    assert all(enabled and autocast == torch.bfloat16 and dtype == torch.bfloat16 and cl
+               for enabled, autocast, dtype, cl in bf16[2]), "forward not under bfloat16 autocast with channels_last"
+    print("{:>22} {:>10} {:>s}".format("run", "time [s]", "train / test loss per epoch"))
+    for name, (train_loss, test_loss, _, elapsed) in [("fp32", fp32), ("bf16 + channels_last", bf16)]:
+        print("{:>22} {:>10.1f} {} / {}".format(name, elapsed, np.round(train_loss, 5), np.round(test_loss, 5)))
+    for a, b in [(fp32[0], bf16[0]), (fp32[1], bf16[1])]:
+        assert np.allclose(b, a, rtol = args.rtol, atol = 0), "bf16 losses differ from fp32 by {:.3g}".format(
+            np.max(np.abs(b-a)/np.abs(a)))
+    print("{} bf16 forwards, losses within rtol = {} of fp32".format(len(bf16[2]), args.rtol))
@@ -0,0 +1,121 @@
+""" Cost of the Checkpoint.py checkpoints for models of growing size: the time a save blocks the training loop
+(synchronous torch.save against CheckpointManager.save, which only snapshots on the device and queues) and the
+restart time until the model and optimizer are restored (torch.load against the memory mapped load).
+The files are in the page cache right after writing, drop it (or pass --cold on Linux as root) for disk numbers.
+First checks that the checkpoints of Trainer.train load with the default torch.load(weights_only = True), through
+Inference.load_model, that a resumed run restores the split and the random states and that a fresh run does not
+resume the epochs of an earlier, longer one.
+Run from this folder: python checkpoint_restart.py [--cold]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Model import UNet, PaddedUNet
+from Metrics import snapshot
+from Checkpoint import CheckpointManager, rng_state
+from Dataloader import load_data
+from Trainer import train
+from Inference import load_model
+
+
+def round_trip():
+    """ Two epochs of train() on synthetic data, the checkpoint read back by load_model and torch.load with the
+    default weights_only = True, then one resumed epoch """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            rng = np.random.default_rng(0)
+            np.save("input_images_10k.npy", (rng.random((32, 128, 128)) > 0.9)*1.0)
+            np.save("target_images_10k.npy", rng.random((32, 128, 128)))
+            trainloader, testloader, _, _ = load_data(split = 0.25, batch_size = 8, device = 'cpu', path = tmp)
+            train('cpu', 2, False, testloader, trainloader, model = PaddedUNet(3, 4))
+            model = load_model("checkpoint_cpu.pt", model = PaddedUNet(3, 4))
+            state = torch.load("checkpoint_cpu_epoch0001.pt")
+            assert all(torch.equal(v, state['model_state_dict'][k]) for k, v in model.state_dict().items())
+            assert np.array_equal(np.asarray(state['split'][1]), testloader.dataset.indices)
+            train('cpu', 3, True, testloader, trainloader, model = PaddedUNet(3, 4))
+            assert len(torch.load("checkpoint_cpu_epoch0002.pt")['TrainLoss']) == 3
+
+            #a fresh short run after a longer one resumes itself, not the epochs left by the longer run
+            train('cpu', 4, False, testloader, trainloader, model = PaddedUNet(3, 4))
+            train('cpu', 2, False, testloader, trainloader, model = PaddedUNet(3, 4))
+            short = torch.load("checkpoint_cpu_epoch0001.pt")['TrainLoss']
+            assert CheckpointManager("checkpoint_cpu").latest().endswith("checkpoint_cpu_epoch0001.pt")
+            train('cpu', 3, True, testloader, trainloader, model = PaddedUNet(3, 4))
+            assert torch.load("checkpoint_cpu_epoch0002.pt")['TrainLoss'][:2] == short
+            assert CheckpointManager("checkpoint_cpu").epochs() == [0, 1, 2]
+        finally:
+            os.chdir(cwd)
+
+
+def training_state(model):
+    """ Model and Adam state after one step, as saved by Trainer.train """
+    optimizer = torch.optim.Adam(model.parameters(), lr = 1e-3)
+    model(torch.rand(1, 128, 128)).mean().backward()
+    optimizer.step()
+    return optimizer, {
+        'epoch': 0,
+        'best_epoch': 0,
+        'model_state_dict': model.state_dict(),
+        'optimizer_state_dict': optimizer.state_dict(),
+        'TrainLoss': [0.0],
+        'TestLoss': [0.0],
+        'rng_state': rng_state(),
+    }
+
+
+def drop_caches():
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cold", action = "store_true", help = "drop the page cache before every load")
+    args = parser.parse_args()
+
+    round_trip()
+    print("train() checkpoints load with weights_only = True and resume")
+    models = {
+        "UNet": lambda: UNet(),
+        "PaddedUNet(4, 128)": lambda: PaddedUNet(4, 128),
+        "PaddedUNet(5, 128)": lambda: PaddedUNet(5, 128),
+    }
+    print("{:>20} {:>10} {:>14} {:>14} {:>14} {:>14}".format("model", "size [MB]", "sync save [s]", "async save [s]",
+                                                            "torch.load [s]", "mmap load [s]"))
+    for name, make in models.items():
+        model = make()
+        optimizer, state = training_state(model)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sync.pt")
+            t_0 = time.perf_counter()
+            torch.save(state, path)
+            sync_save = time.perf_counter()-t_0
+
+            manager = CheckpointManager("checkpoint", tmp)
+            t_0 = time.perf_counter()
+            manager.save(snapshot(state), 0, best = True)
+            async_save = time.perf_counter()-t_0
+            manager.flush()
+
+            def restart(load):
+                if args.cold:
+                    drop_caches()
+                t_0 = time.perf_counter()
+                loaded = load()
+                model.load_state_dict(loaded['model_state_dict'])
+                optimizer.load_state_dict(loaded['optimizer_state_dict'])
+                return time.perf_counter()-t_0
+
+            full = restart(lambda: torch.load(path, weights_only = False))
+            mapped = restart(manager.load)
+            print("{:>20} {:>10.1f} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.3f}".format(name,
+                  os.path.getsize(path)/2**20, sync_save, async_save, full, mapped))
@@ -0,0 +1,45 @@
+""" Samples/sec of the training data paths on synthetic 128x128 data: the per item Data + DataLoader path against
+DeviceBatchLoader with batched augmentation.
+Run from this folder: python dataloader_throughput.py [device]
+"""
+import os
+import sys
+import time
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Dataloader import Data, DeviceBatchLoader
+from torch.utils.data import DataLoader
+
+
+def throughput(loader, device, epochs = 3):
+    """ Samples per second over full epochs, the first epoch is a warm up """
+    for x, y in loader:
+        pass
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    n = 0
+    t_0 = time.perf_counter()
+    for _ in range(epochs):
+        for x, y in loader:
+            n += len(x)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return n/(time.perf_counter()-t_0)
+
+
+if __name__ == "__main__":
+    device = sys.argv[1] if len(sys.argv) > 1 else "cpu"
+    num_samples = 4000
+    x = (np.random.rand(num_samples, 128, 128) > 0.9).astype(np.float64)
+    y = np.random.rand(num_samples, 128, 128)
+    data = Data(x, y, device)
+
+    print("{:>10} {:>22} {:>22} {:>22}".format("batch_size", "DataLoader [1/s]", "DeviceBatchLoader [1/s]",
+                                              "+ rotate [1/s]"))
+    for batch_size in [10, 64, 256]:
+        before = throughput(DataLoader(dataset = data, batch_size = batch_size, shuffle = True), device)
+        after = throughput(DeviceBatchLoader(data, batch_size), device)
+        rotate = throughput(DeviceBatchLoader(data, batch_size, rotate = True), device)
+        print("{:>10} {:>22.0f} {:>22.0f} {:>22.0f}".format(batch_size, before, after, rotate))
@@ -0,0 +1,73 @@
+""" Scaling of Distributed.py (DistributedDataParallel, gloo) from 1 to N ranks on synthetic data. Every epoch covers
+the data once, split over the ranks with the per rank batch size kept (global batch N*batch_size), so
+efficiency = throughput(N)/(N*throughput(1)). On a single machine the ranks share the cores.
+Run from this folder: python ddp_scaling.py [--world_sizes 1 2 4] [--width 16] [--samples 256]
+"""
+import argparse
+import functools
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Model import UNet, PaddedUNet
+from Dataloader import load_data_distributed
+from Distributed import setup, cleanup, rank_device
+from Trainer import train
+
+
+def timed_worker(rank, world_size, args, model_fn, out_dir):
+    """ Like Distributed.worker, rank 0 writes the training time (without startup and data setup) to out_dir """
+    setup(rank, world_size, args.backend, args.port)
+    try:
+        device = rank_device(rank, args.device)
+        if device == 'cpu':
+            torch.set_num_threads(max(1, (os.cpu_count() or 1)//world_size))
+        torch.manual_seed(0)
+        trainloader, testloader, _, _ = load_data_distributed(0.25, args.batch_size, device, rank, world_size,
+                                                              path = out_dir)
+        os.chdir(out_dir)
+        dist.barrier()
+        t_0 = time.perf_counter()
+        train(device, args.epochs, False, testloader, trainloader, model = model_fn())
+        dist.barrier()
+        if rank == 0:
+            with open("time_{}.txt".format(world_size), "w") as f:
+                f.write(str(time.perf_counter()-t_0))
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--world_sizes", type = int, nargs = "+", default = [1, 2, 4])
+    parser.add_argument("--samples", type = int, default = 256)
+    parser.add_argument("--batch_size", type = int, default = 8, help = "per rank")
+    parser.add_argument("--epochs", type = int, default = 2)
+    parser.add_argument("--width", type = int, default = None, help = "train PaddedUNet(3, width) instead of UNet()")
+    parser.add_argument("--device", default = "cpu")
+    parser.add_argument("--backend", default = "gloo")
+    parser.add_argument("--port", type = int, default = 29511)
+    args = parser.parse_args()
+
+    model_fn = functools.partial(PaddedUNet, 3, args.width) if args.width else UNet
+    print("cpus: {}".format(os.cpu_count()))
+    print("{:>10} {:>10} {:>12} {:>12}".format("ranks", "time [s]", "samples/s", "efficiency"))
+    with tempfile.TemporaryDirectory() as out_dir:
+        rng = np.random.default_rng(0)
+        np.save(os.path.join(out_dir, "input_images_10k.npy"), (rng.random((args.samples, 128, 128)) > 0.9).astype(np.float32))
+        np.save(os.path.join(out_dir, "target_images_10k.npy"), rng.random((args.samples, 128, 128), dtype = np.float32))
+        base = None
+        for world_size in args.world_sizes:
+            mp.spawn(timed_worker, args = (world_size, args, model_fn, out_dir), nprocs = world_size, join = True)
+            with open(os.path.join(out_dir, "time_{}.txt".format(world_size))) as f:
+                elapsed = float(f.read())
+            #every epoch trains on the train split and evaluates the test split, both counted
+            rate = args.epochs*args.samples/elapsed
+            base = base or rate/world_size
+            print("{:>10} {:>10.1f} {:>12.1f} {:>12.2f}".format(world_size, elapsed, rate, rate/(world_size*base)))
@@ -0,0 +1,60 @@
+""" Root to tip path lengths of batches of RRT graphs (generate_graphs.generate_graph), VascularGraph (one traversal
+for the whole batch) against scipy's Dijkstra, one call per graph from the root and one call per (root, tip)
+pair like Solver/Graph_distance.jl. Prints the time per edge, which stays flat for VascularGraph.
+Run from this folder: python graph_traversal.py [--num_points 30] [--batches 10 100 1000 10000]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Graphs"))
+from generate_graphs import generate_graph
+from VascularGraph import VascularGraph
+
+
+def adjacency(nodes, lines):
+    lengths = np.linalg.norm(nodes[lines[:, 0]]-nodes[lines[:, 1]], axis = 1)
+    return coo_matrix((lengths, (lines[:, 0], lines[:, 1])), shape = (len(nodes), len(nodes))).tocsr()
+
+
+def per_graph(graphs):
+    return [dijkstra(adjacency(nodes, lines), directed = False, indices = 0) for nodes, lines in graphs]
+
+
+def per_tip(graphs):
+    distances = []
+    for nodes, lines in graphs:
+        A = adjacency(nodes, lines)
+        tips = np.setdiff1d(lines[:, 1], lines[:, 0])
+        distances.append([dijkstra(A, directed = False, indices = 0)[tip] for tip in tips])
+    return distances
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_points", type = int, default = 30)
+    parser.add_argument("--batches", type = int, nargs = "+", default = [10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    graphs = [generate_graph(seed, args.num_points, 1.0, 1.0) for seed in range(max(args.batches))]
+    graphs = [(nodes, lines.reshape(-1, 2)) for nodes, lines in graphs]
+    print("{:>8} {:>10} {:>22} {:>22} {:>22}".format("graphs", "edges", "VascularGraph [us/edge]",
+                                                     "dijkstra/graph [us/edge]", "dijkstra/tip [us/edge]"))
+    for G in args.batches:
+        batch = graphs[:G]
+        edges = sum(len(lines) for _, lines in batch)
+        t_0 = time.perf_counter()
+        graph = VascularGraph.batch(batch)
+        t_1 = time.perf_counter()
+        reference = per_graph(batch)
+        t_2 = time.perf_counter()
+        per_tip(batch[:min(G, 1000)])
+        t_3 = time.perf_counter()
+        assert all(np.allclose(d, r) for d, r in zip(graph.split(graph.distance), reference))
+        tip_edges = sum(len(lines) for _, lines in batch[:min(G, 1000)])
+        print("{:>8} {:>10} {:>22.3f} {:>22.3f} {:>22.3f}".format(G, edges, 1e6*(t_1-t_0)/edges, 1e6*(t_2-t_1)/edges,
+                                                                 1e6*(t_3-t_2)/tip_edges))
@@ -0,0 +1,45 @@
+""" Images/sec of UNet inference on synthetic masks: one sample at a time with autograd (as in Eval.py) against
+Inference.predict with inference_mode, batching and TorchScript.
+Run from this folder: python inference_throughput.py [device]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Model import UNet
+from Inference import load_model, predict
+
+
+def images_per_second(f, num_images):
+    f(min(num_images, 8)) #warm up
+    t_0 = time.perf_counter()
+    f(num_images)
+    return num_images/(time.perf_counter()-t_0)
+
+
+if __name__ == "__main__":
+    device = sys.argv[1] if len(sys.argv) > 1 else "cpu"
+    num_images = 64
+    masks = (np.random.rand(num_images, 128, 128) > 0.9).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = os.path.join(tmp, "checkpoint.pt")
+        torch.save({'model_state_dict': UNet().state_dict()}, checkpoint)
+        model = load_model(checkpoint, device)
+        scripted = load_model(checkpoint, device, torchscript = True)
+
+    def single(n):
+        for i in range(n):
+            model(torch.from_numpy(masks[i]).to(device).unsqueeze(0)).detach().cpu()
+
+    print("{:>32} {:>12}".format("mode", "images/s"))
+    print("{:>32} {:>12.1f}".format("per sample, autograd", images_per_second(single, num_images)))
+    for batch_size in [1, 16, 64]:
+        print("{:>32} {:>12.1f}".format("predict, batch_size = {}".format(batch_size), images_per_second(
+            lambda n: predict(model, masks[:n], batch_size, device), num_images)))
+    print("{:>32} {:>12.1f}".format("predict torchscript, batch_size = 16", images_per_second(
+        lambda n: predict(scripted, masks[:n], 16, device), num_images)))
@@ -0,0 +1,101 @@
+""" Load generator for CNN/Server.py. Sends single mask requests from a number of concurrent clients and reports
+throughput and latency. Without --url/--socket an in-process server with random weights is started twice, with
+max_batch_size = 1 (single sample inference) and with micro-batching, to show the gain as concurrency goes up.
+Run from this folder: python load_server.py [--requests 64] [--small]
+                      python load_server.py --url 127.0.0.1:8080
+"""
+import argparse
+import http.client
+import os
+import socket
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def connect(url = None, socket_path = None):
+    if socket_path is not None:
+        return UnixHTTPConnection(socket_path)
+    host, port = url.split(":")
+    return http.client.HTTPConnection(host, int(port))
+
+
+def run_load(concurrency, num_requests, url = None, socket_path = None):
+    """ num_requests spread over concurrency client threads, returns (requests/s, p50 ms, p99 ms) """
+    mask = (np.random.rand(128, 128) > 0.9).astype(np.float32).tobytes()
+    latencies = []
+    lock = threading.Lock()
+
+    def client(n):
+        conn = connect(url, socket_path)
+        own = []
+        for _ in range(n):
+            t_0 = time.perf_counter()
+            conn.request("POST", "/predict", body = mask)
+            response = conn.getresponse()
+            assert response.status == 200 and len(response.read()) == 4*128*128
+            own.append(time.perf_counter()-t_0)
+        conn.close()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target = client, args = (num_requests//concurrency,)) for _ in range(concurrency)]
+    t_0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter()-t_0
+    latencies = np.array(latencies)*1e3
+    return len(latencies)/elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default = None, help = "host:port of a running server")
+    parser.add_argument("--socket", default = None, help = "Unix socket of a running server")
+    parser.add_argument("--requests", type = int, default = 64)
+    parser.add_argument("--concurrency", type = int, nargs = "+", default = [1, 4, 16])
+    parser.add_argument("--max_wait_ms", type = float, default = 2, help = "of the in-process micro-batching server")
+    parser.add_argument("--small", action = "store_true", help = "in-process server with PaddedUNet(3, 8)")
+    args = parser.parse_args()
+
+    header = "{:>16} {:>12} {:>12} {:>10} {:>10}".format("server", "concurrency", "requests/s", "p50 [ms]", "p99 [ms]")
+    if args.url or args.socket:
+        print(header)
+        for c in args.concurrency:
+            print("{:>16} {:>12} {:>12.1f} {:>10.1f} {:>10.1f}".format("external", c,
+                  *run_load(c, args.requests, args.url, args.socket)))
+        sys.exit()
+
+    from Model import UNet, PaddedUNet
+    from Server import MicroBatcher, make_server
+
+    model = (PaddedUNet(3, 8) if args.small else UNet()).eval()
+    print(header)
+    for max_batch_size in [1, 32]:
+        batcher = MicroBatcher(model, max_batch_size = max_batch_size, max_wait_ms = args.max_wait_ms)
+        server = make_server(batcher, port = 0)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        url = "127.0.0.1:{}".format(server.server_address[1])
+        run_load(1, 2, url) #warm up
+        for c in args.concurrency:
+            batcher.reset_metrics()
+            rate, p50, p99 = run_load(c, args.requests, url)
+            name = "single sample" if max_batch_size == 1 else "micro-batch {}".format(max_batch_size)
+            print("{:>16} {:>12} {:>12.1f} {:>10.1f} {:>10.1f}   mean batch {:.1f}".format(
+                  name, c, rate, p50, p99, batcher.metrics()['mean_batch_size']))
+        server.shutdown()
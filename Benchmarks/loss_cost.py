@@ -0,0 +1,62 @@
+""" Cost per training step of the objectives in Losses.py against the MSE: the loss alone (forward and backward on
+random fields) and a full UNet step (forward, loss, backward, Adam).
+Run from this folder: python loss_cost.py [--device cuda] [--batch_size 10] [--blur 0.02] [--scaling 0.5]
+"""
+import argparse
+import os
+import sys
+import time
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Model import UNet
+from Losses import make_loss
+
+
+def step_time(f, device, repeats = 3):
+    """ Best time in ms of f() """
+    f()
+    best = float("inf")
+    for _ in range(repeats):
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        t_0 = time.perf_counter()
+        f()
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter()-t_0)
+    return 1e3*best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default = "cpu")
+    parser.add_argument("--batch_size", type = int, default = 10)
+    parser.add_argument("--blur", type = float, default = 0.02)
+    parser.add_argument("--scaling", type = float, default = 0.5)
+    args = parser.parse_args()
+
+    x = (torch.rand(args.batch_size, 128, 128, device = args.device) > 0.9).float()
+    y = torch.rand(args.batch_size, 128, 128, device = args.device)
+    model = UNet().to(args.device)
+    optimizer = torch.optim.Adam(model.parameters(), lr = 1e-3)
+
+    print("{:>14} {:>12} {:>14} {:>12}".format("objective", "loss [ms]", "UNet step [ms]", "vs MSE"))
+    base = None
+    for objective in ["mse", "sinkhorn", "mse+sinkhorn"]:
+        kwargs = {} if objective == "mse" else {"blur": args.blur, "scaling": args.scaling}
+        loss_fn = make_loss(objective, **kwargs)
+        pred = torch.rand(args.batch_size, 1, 128, 128, device = args.device, requires_grad = True)
+
+        def loss_only():
+            loss_fn(pred, y.unsqueeze(1)).backward()
+
+        def train_step():
+            optimizer.zero_grad()
+            loss_fn(model(x), y.unsqueeze(1)).backward()
+            optimizer.step()
+
+        step = step_time(train_step, args.device)
+        base = base or step
+        print("{:>14} {:>12.1f} {:>14.1f} {:>12.2f}".format(objective, step_time(loss_only, args.device), step,
+                                                            step/base))
@@ -0,0 +1,122 @@
+""" Disk footprint, load time and peak memory of the .npy dataset (float64 masks and targets) against the packed
+format of Packed.py (bit packed masks, float16 targets), on synthetic datasets of the given sizes written to --dir.
+Every measurement runs in a fresh process, peak memory is the growth of its maximum resident set size over the
+imports:
+    epoch pass   all batches of the train split in random order through MemmapData / PackedData (mmap = True)
+    in memory    load_data(mmap = False) style: the split read into host memory (in the stored dtype), skipped when
+                 it does not fit in --memory_limit
+The file pages touched through the memory maps count towards the resident set, the page cache is not dropped.
+Run from this folder: python packed_format.py [--sizes 10000 100000] [--dir /tmp/packed_benchmark]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Dataloader import MemmapData, load_split
+from Packed import PackedData, write_packed, packed_dir
+
+
+def write_dataset(directory, n, chunk = 1000):
+    """ n synthetic binary masks with vessel like lines and smooth float64 targets as input_images_10k.npy and
+    target_images_10k.npy, written chunk by chunk """
+    os.makedirs(directory, exist_ok = True)
+    rng = np.random.default_rng(0)
+    masks = np.lib.format.open_memmap(os.path.join(directory, "input_images_10k.npy"), mode = 'w+',
+                                      dtype = np.float64, shape = (n, 128, 128))
+    targets = np.lib.format.open_memmap(os.path.join(directory, "target_images_10k.npy"), mode = 'w+',
+                                        dtype = np.float64, shape = (n, 128, 128))
+    grid = np.linspace(0, 1, 128)
+    for start in range(0, n, chunk):
+        m = min(chunk, n-start)
+        rows, cols = rng.integers(0, 128, (2, m, 1, 40))
+        x = np.zeros((m, 128, 128))
+        x[np.arange(m)[:, None, None], rows, np.clip(cols+np.arange(40)[:, None], 0, 127)] = 1
+        masks[start:start+m] = x
+        targets[start:start+m] = np.exp(-rng.random((m, 1, 1))*(grid[:, None]+grid[None, :]))
+    masks.flush()
+    targets.flush()
+
+
+def disk_size(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+
+def peak_rss():
+    """ High water mark of the resident set of this process in bytes (VmHWM, reset by exec unlike ru_maxrss) """
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1])*1024 for line in f if line.startswith("VmHWM"))
+
+
+def measure(kind, mode, directory, batch_size):
+    """ Runs in the child process, returns (seconds, growth of the peak rss in bytes over the imports) """
+    if kind == "npy":
+        paths = os.path.join(directory, "input_images_10k.npy"), os.path.join(directory, "target_images_10k.npy")
+        dataset = lambda idx, mmap: MemmapData(*paths, idx, 'cpu', mmap = mmap)
+    else:
+        folder = packed_dir(os.path.join(directory, "input_images_10k.npy"))
+        paths = os.path.join(folder, "masks.npy"), os.path.join(folder, "targets.npy")
+        dataset = lambda idx, mmap: PackedData(folder, idx, 'cpu', mmap = mmap)
+    train_idx, _ = load_split(*paths, 0.1, 0)
+    baseline = peak_rss()
+    t_0 = time.perf_counter()
+    data = dataset(train_idx, mode != "memory")
+    if mode == "pass":
+        order = np.random.default_rng(0).permutation(len(data))
+        for start in range(0, len(data), batch_size):
+            data[order[start:start+batch_size]]
+    elapsed = time.perf_counter()-t_0
+    return elapsed, peak_rss()-baseline
+
+
+def run(kind, directory, mode, batch_size):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", kind, mode, "--dir", directory,
+                          "--batch_size", str(batch_size)], capture_output = True, text = True, check = True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [10000, 100000])
+    parser.add_argument("--dir", default = "/tmp/packed_benchmark")
+    parser.add_argument("--batch_size", type = int, default = 64)
+    parser.add_argument("--memory_limit", type = float, default = 4.0, help = "GB, larger in memory loads are skipped")
+    parser.add_argument("--keep", action = "store_true", help = "keep the datasets in --dir")
+    parser.add_argument("--measure", nargs = 2, default = None, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        print(json.dumps(measure(*args.measure, args.dir, args.batch_size)))
+        sys.exit()
+
+    print("{:>8} {:>6} {:>10} {:>14} {:>14} {:>14} {:>14}".format("samples", "format", "disk [MB]", "pass [s]",
+                                                                "pass RSS [MB]", "in memory [s]", "memory RSS [MB]"))
+    for n in args.sizes:
+        directory = os.path.join(args.dir, str(n))
+        write_dataset(directory, n)
+        t_0 = time.perf_counter()
+        folder = write_packed(os.path.join(directory, "input_images_10k.npy"),
+                              os.path.join(directory, "target_images_10k.npy"))
+        convert = time.perf_counter()-t_0
+        files = {
+            "npy": [os.path.join(directory, f) for f in ("input_images_10k.npy", "target_images_10k.npy")],
+            "packed": [os.path.join(folder, f) for f in ("masks.npy", "targets.npy", "meta.json")],
+        }
+        for kind, paths in files.items():
+            size = disk_size(paths)
+            pass_time, pass_rss = run(kind, directory, "pass", args.batch_size)
+            if 0.9*size < args.memory_limit*1e9:
+                memory_time, memory_rss = run(kind, directory, "memory", args.batch_size)
+                memory = "{:>14.2f} {:>14.0f}".format(memory_time, memory_rss/1e6)
+            else:
+                memory = "{:>14} {:>14}".format("skipped", "skipped")
+            print("{:>8} {:>6} {:>10.0f} {:>14.2f} {:>14.0f} {}".format(n, kind, size/1e6, pass_time, pass_rss/1e6,
+                                                                       memory))
+        print("{:>8} conversion to the packed format: {:.1f} s".format(n, convert))
+        if not args.keep:
+            shutil.rmtree(directory)
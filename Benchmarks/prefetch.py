@@ -0,0 +1,67 @@
+""" Data wait as a fraction of the training step time for the loader modes of load_data on synthetic data written
+to disk: the memory mapped DataLoader (batches read and augmented in the training loop), and prefetch = True with
+the background thread only (num_workers = 0) and with worker processes.
+Run from this folder: python prefetch.py [--device cuda] [--samples 512] [--width 16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Model import PaddedUNet
+from Dataloader import load_data
+
+
+def epoch(loader, model, optimizer, device):
+    """ (wall time, time spent waiting for batches) of one training epoch """
+    loss_fn = nn.MSELoss()
+    wait = 0.0
+    t_0 = time.perf_counter()
+    batches = iter(loader)
+    while True:
+        t_1 = time.perf_counter()
+        batch = next(batches, None)
+        wait += time.perf_counter()-t_1
+        if batch is None:
+            break
+        x, y = batch
+        optimizer.zero_grad()
+        loss_fn(model(x), y.unsqueeze(1)).backward()
+        optimizer.step()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return time.perf_counter()-t_0, wait
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default = "cpu")
+    parser.add_argument("--samples", type = int, default = 512)
+    parser.add_argument("--batch_size", type = int, default = 16)
+    parser.add_argument("--width", type = int, default = 16, help = "of the PaddedUNet(3, width) trained")
+    args = parser.parse_args()
+
+    modes = {
+        "mmap DataLoader": dict(mmap = True),
+        "prefetch, thread": dict(mmap = True, prefetch = True, num_workers = 0),
+        "prefetch, 2 workers": dict(mmap = True, prefetch = True, num_workers = 2),
+        "prefetch, 2 workers, in memory": dict(prefetch = True, num_workers = 2),
+    }
+    print("cpus: {}".format(os.cpu_count()))
+    print("{:>32} {:>12} {:>12} {:>12}".format("loader", "epoch [s]", "wait [s]", "wait/step"))
+    with tempfile.TemporaryDirectory() as tmp:
+        rng = np.random.default_rng(0)
+        np.save(os.path.join(tmp, "input_images_10k.npy"), (rng.random((args.samples, 128, 128)) > 0.9).astype(np.float64))
+        np.save(os.path.join(tmp, "target_images_10k.npy"), rng.random((args.samples, 128, 128)))
+        for name, kwargs in modes.items():
+            trainloader = load_data(0.25, args.batch_size, args.device, path = tmp, **kwargs)[0]
+            model = PaddedUNet(3, args.width).to(args.device)
+            optimizer = torch.optim.Adam(model.parameters(), lr = 1e-3)
+            epoch(trainloader, model, optimizer, args.device) #warm up, starts the workers
+            elapsed, wait = epoch(trainloader, model, optimizer, args.device)
+            print("{:>32} {:>12.2f} {:>12.2f} {:>12.1%}".format(name, elapsed, wait, wait/elapsed))
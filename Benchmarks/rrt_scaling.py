@@ -0,0 +1,32 @@
+""" Runtime of RRT() against num_points for the brute force and the KD-tree (fast = True) nearest node lookups.
+Run from this folder: python rrt_scaling.py
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Graphs"))
+from RRT import RRT
+
+
+def time_RRT(num_points, connectivity, seed, fast, repeats = 3):
+    """ Best of repeats wall time in seconds """
+    best = np.inf
+    for _ in range(repeats):
+        t_0 = time.perf_counter()
+        points = RRT(num_points, connectivity, np.array([0, 0]), seed, fast = fast)
+        best = min(best, time.perf_counter()-t_0)
+    return best, points
+
+
+if __name__ == "__main__":
+    connectivity = 0.2
+    seed = 1
+    print("{:>10} {:>12} {:>12} {:>8}".format("num_points", "brute [s]", "fast [s]", "speedup"))
+    for num_points in [100, 1000, 4000, 16000, 32000]:
+        repeats = 1 if num_points > 10000 else 3
+        t_brute, p_brute = time_RRT(num_points, connectivity, seed, False, repeats)
+        t_fast, p_fast = time_RRT(num_points, connectivity, seed, True, repeats)
+        assert np.array_equal(p_brute, p_fast), "fast RRT differs at num_points = {}".format(num_points)
+        print("{:>10} {:>12.4f} {:>12.4f} {:>8.1f}".format(num_points, t_brute, t_fast, t_brute/t_fast))
@@ -0,0 +1,47 @@
+""" Samples per second of the Python grid solver (Graphs/grid_solver.py) on RRT graphs for several pool sizes, and
+its accuracy: the relative L2 difference to the block averaged solutions of 2x and 4x finer grids and, given
+Gridap targets of the same graphs (--graphs, a generate_graphs.py folder, and --targets, target_images.npy in
+the same order), the relative L2 and max error against them.
+Run from this folder: python solver_throughput.py [--samples 200] [--workers 0 1 2 4]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Graphs"))
+from generate_graphs import generate_graph, load_graphs
+from grid_solver import GridSolver, solve_graphs, relative_error
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type = int, default = 200)
+    parser.add_argument("--workers", type = int, nargs = "+", default = [0, 1, 2, 4])
+    parser.add_argument("--refine", type = int, nargs = "+", default = [2, 4])
+    parser.add_argument("--graphs", default = None)
+    parser.add_argument("--targets", default = None)
+    args = parser.parse_args()
+
+    graphs = [generate_graph(seed, 30, 1.0, 1.0) for seed in range(args.samples)]
+    print("cpus: {}".format(os.cpu_count()))
+    print("{:>8} {:>12}".format("workers", "samples/s"))
+    for workers in args.workers:
+        t_0 = time.perf_counter()
+        solutions = solve_graphs(graphs, workers)
+        print("{:>8} {:>12.1f}".format(workers, len(graphs)/(time.perf_counter()-t_0)))
+
+    print("{:>8} {:>20} {:>20}".format("refine", "mean rel. L2 diff", "max rel. L2 diff"))
+    for k in args.refine:
+        fine = GridSolver(partition = (128*k, 128*k))
+        error = [np.linalg.norm(u-fine.solve(*g).reshape(128, k, 128, k).mean((1, 3)))/np.linalg.norm(u)
+                 for g, u in zip(graphs[:10], solutions[:10])]
+        print("{:>8} {:>20.2e} {:>20.2e}".format(k, np.mean(error), np.max(error)))
+
+    if args.graphs is not None:
+        graphs = [(nodes, lines) for _, nodes, lines in load_graphs(args.graphs)]
+        targets = np.load(args.targets, mmap_mode = 'r')[:len(graphs)]
+        l2, max_error = relative_error(solve_graphs(graphs), np.asarray(targets))
+        print("against {}: relative L2 error mean {:.2e} max {:.2e}, max abs error mean {:.2e} max {:.2e}".format(
+            args.targets, l2.mean(), l2.max(), max_error.mean(), max_error.max()))
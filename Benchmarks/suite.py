@@ -0,0 +1,364 @@
+""" Benchmark suite of the hot paths, from graph generation to the UNet training step, with machine readable results.
+
+Every benchmark is a setup function registered with @benchmark for one or more parameter sets. setup(**params)
+builds its inputs from fixed seeds and returns (run, items): run() is the timed call, items the number of
+samples it processes (for the throughput column, None if it does not apply). run() is called once to warm up and
+then timed up to --repeats times, or until --max_time seconds are spent. Every benchmark runs in a fresh process
+and its peak memory is measured on the warm up call, before any allocator cache is filled: the growth of the
+resident set over the state after setup (VmHWM, reset through /proc/self/clear_refs, Linux only), the peak of the
+Python and numpy allocations traced by tracemalloc and on cuda torch.cuda.max_memory_allocated.
+
+    python suite.py run [--filter unet] [--out results.json] [--device cpu]
+    python suite.py compare base.json results.json [--threshold 0.1]
+
+compare prints the ratios of the median times and peak memory of the benchmarks in both files and exits with
+status 1 if any of them got slower (or larger) by more than the threshold, so it can gate a CI job.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import torch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "..", "Graphs"))
+sys.path.append(os.path.join(HERE, "..", "CNN"))
+from RRT import RRT, connect_RRT, intersect, intersecting_pairs
+from rasterize import binary_masks
+from VascularGraph import VascularGraph
+from grid_solver import GridSolver
+from generate_graphs import generate_graph
+from Dataloader import Data, DeviceBatchLoader, MemmapData
+from Model import UNet
+from Inference import predict_tiled, tile_origins
+from torch.utils.data import DataLoader, BatchSampler, RandomSampler
+
+BENCHMARKS = [] #(name, params, setup)
+DEVICE = "cpu"
+SEED = 0
+
+
+def benchmark(name, params = ({},)):
+    """ Registers setup(**p) for every dict p in params """
+    def register(setup):
+        for p in params:
+            BENCHMARKS.append((name, dict(p), setup))
+        return setup
+    return register
+
+
+def key(name, params):
+    return name+("[{}]".format(",".join("{}={}".format(k, v) for k, v in params.items())) if params else "")
+
+
+def sync():
+    if DEVICE.startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def graphs(num_graphs, num_points = 30):
+    return [generate_graph(seed, num_points, 1.0, 1.0) for seed in range(num_graphs)]
+
+
+_data_dir = None
+
+
+def synthetic_data(n = 1024):
+    """ Folder with n synthetic samples as input_images_10k.npy and target_images_10k.npy, removed at exit """
+    global _data_dir
+    if _data_dir is None:
+        _data_dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(SEED)
+        np.save(os.path.join(_data_dir.name, "input_images_10k.npy"), (rng.random((n, 128, 128)) > 0.9)*1.0)
+        np.save(os.path.join(_data_dir.name, "target_images_10k.npy"), rng.random((n, 128, 128)))
+    return _data_dir.name
+
+
+#graphs
+@benchmark("RRT", [dict(num_points = 1000, fast = False), dict(num_points = 1000, fast = True),
+                   dict(num_points = 10000, fast = True)])
+def rrt(num_points, fast):
+    return lambda: RRT(num_points, 1.0, np.array([0, 0]), SEED, fast = fast), None
+
+
+@benchmark("connect_RRT", [dict(num_points = 1000), dict(num_points = 10000)])
+def connect(num_points):
+    points = RRT(num_points, 1.0, np.array([0, 0]), SEED, fast = True)
+    return lambda: connect_RRT(points, 1.0), None
+
+
+@benchmark("intersect", [dict(pairs = 1000)])
+def intersect_pairs(pairs):
+    p = np.random.default_rng(SEED).random((pairs, 4, 2))
+    return lambda: [intersect(*q) for q in p], pairs
+
+
+@benchmark("intersecting_pairs", [dict(num_points = 10000)])
+def all_intersections(num_points):
+    nodes, lines = connect_RRT(RRT(num_points, 1.0, np.array([0, 0]), SEED, fast = True), 1.0)
+    segments = nodes[lines]
+    return lambda: intersecting_pairs(segments), len(segments)
+
+
+@benchmark("binary_masks", [dict(num_graphs = 100)])
+def masks(num_graphs):
+    batch = graphs(num_graphs)
+    return lambda: binary_masks(batch), num_graphs
+
+
+@benchmark("VascularGraph.batch", [dict(num_graphs = 1000)])
+def traversal(num_graphs):
+    batch = graphs(num_graphs)
+    return lambda: VascularGraph.batch(batch), num_graphs
+
+
+@benchmark("GridSolver.solve", [dict(num_graphs = 10)])
+def solve(num_graphs):
+    batch = graphs(num_graphs)
+    solver = GridSolver()
+    return lambda: [solver.solve(*g) for g in batch], num_graphs
+
+
+#data loading
+@benchmark("Data.__getitem__", [dict(samples = 1024)])
+def getitem(samples):
+    path = synthetic_data(samples)
+    data = Data(np.load(os.path.join(path, "input_images_10k.npy")), np.load(os.path.join(path, "target_images_10k.npy")),
+                DEVICE)
+    return lambda: [data[i] for i in range(len(data))], samples
+
+
+@benchmark("DataLoader", [dict(samples = 1024, batch_size = 32)])
+def dataloader(samples, batch_size):
+    path = synthetic_data(samples)
+    data = Data(np.load(os.path.join(path, "input_images_10k.npy")), np.load(os.path.join(path, "target_images_10k.npy")),
+                DEVICE)
+    loader = DataLoader(data, batch_size = batch_size, shuffle = True)
+    return lambda: [sync() for _ in loader], samples
+
+
+@benchmark("DeviceBatchLoader", [dict(samples = 1024, batch_size = 32)])
+def device_loader(samples, batch_size):
+    path = synthetic_data(samples)
+    data = Data(np.load(os.path.join(path, "input_images_10k.npy")), np.load(os.path.join(path, "target_images_10k.npy")),
+                DEVICE)
+    loader = DeviceBatchLoader(data, batch_size)
+    return lambda: [sync() for _ in loader], samples
+
+
+@benchmark("MemmapData", [dict(samples = 1024, batch_size = 32)])
+def memmap_loader(samples, batch_size):
+    path = synthetic_data(samples)
+    data = MemmapData(os.path.join(path, "input_images_10k.npy"), os.path.join(path, "target_images_10k.npy"),
+                      np.arange(samples), DEVICE)
+    loader = DataLoader(data, batch_size = None, sampler = BatchSampler(RandomSampler(data), batch_size, False))
+    return lambda: [sync() for _ in loader], samples
+
+
+#model
+@benchmark("UNet.forward", [dict(batch_size = b, resolution = r) for r in (128, 256) for b in (1, 8)])
+def forward(batch_size, resolution):
+    model = UNet().to(DEVICE).eval()
+    x = torch.rand(batch_size, resolution, resolution, device = DEVICE)
+
+    def run():
+        with torch.inference_mode():
+            model(x)
+        sync()
+    return run, batch_size
+
+
+@benchmark("UNet.backward", [dict(batch_size = b, resolution = r) for r in (128, 256) for b in (1, 8)])
+def backward(batch_size, resolution):
+    """ forward and backward pass """
+    model = UNet().to(DEVICE).train()
+    x = torch.rand(batch_size, resolution, resolution, device = DEVICE)
+
+    def run():
+        model.zero_grad(set_to_none = True)
+        model(x).square().mean().backward()
+        sync()
+    return run, batch_size
+
+
+@benchmark("predict_tiled", [dict(resolution = 512, batch_size = b) for b in (4, 16)])
+def tiled(resolution, batch_size):
+    """ one large mask in overlapping 128x128 tiles, items are tiles """
+    model = UNet().to(DEVICE).eval()
+    mask = (np.random.default_rng(0).random((resolution, resolution)) > 0.9).astype(np.float32)
+    tiles = len(tile_origins(resolution, 128, 96))**2
+    return lambda: predict_tiled(model, mask, batch_size = batch_size, device = DEVICE), tiles
+
+
+def rss():
+    with open("/proc/self/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return int(fields["VmRSS"].split()[0])*1024, int(fields["VmHWM"].split()[0])*1024
+
+
+def reset_peak_rss():
+    """ Resets VmHWM to the current resident set, False where that is not supported """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(setup, params, repeats, max_time):
+    np.random.seed(SEED)
+    torch.manual_seed(SEED)
+    run, items = setup(**params)
+    gc.collect()
+    supported = reset_peak_rss()
+    before = rss()[0]
+    if DEVICE.startswith("cuda"):
+        torch.cuda.reset_peak_memory_stats()
+    tracemalloc.start()
+    run() #warm up
+    traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    peak_rss = rss()[1]-before if supported else None
+
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeats and (not times or time.perf_counter()-start < max_time):
+        t_0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter()-t_0)
+    result = {
+        "params": params,
+        "times": times,
+        "min": min(times),
+        "median": float(np.median(times)),
+        "items": items,
+        "items_per_s": items/float(np.median(times)) if items else None,
+        "peak_rss": peak_rss,
+        "peak_traced": traced,
+    }
+    if DEVICE.startswith("cuda"):
+        result["peak_cuda"] = torch.cuda.max_memory_allocated()
+    return result
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd = HERE, capture_output = True, text = True,
+                                check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.now().isoformat(timespec = "seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "device": DEVICE,
+        "torch_threads": torch.get_num_threads(),
+        "seed": SEED,
+    }
+
+
+def run_one(k, repeats, max_time):
+    """ Measures the benchmark k in a fresh process """
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "run", "--one", k, "--device", DEVICE,
+                          "--repeats", str(repeats), "--max_time", str(max_time)],
+                         capture_output = True, text = True, check = True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+def run_suite(pattern = None, repeats = 5, max_time = 10.0):
+    results = {}
+    print("{:>44} {:>12} {:>12} {:>12} {:>14} {:>14}".format("benchmark", "median [ms]", "min [ms]", "items/s",
+                                                               "peak RSS [MB]", "traced [MB]"))
+    for name, params, setup in BENCHMARKS:
+        k = key(name, params)
+        if pattern and not re.search(pattern, k):
+            continue
+        r = run_one(k, repeats, max_time)
+        results[k] = r
+        print("{:>44} {:>12.2f} {:>12.2f} {:>12} {:>14} {:>14.1f}".format(
+            k, 1e3*r["median"], 1e3*r["min"], "{:.1f}".format(r["items_per_s"]) if r["items_per_s"] else "-",
+            "{:.1f}".format(r["peak_rss"]/1e6) if r["peak_rss"] is not None else "-", r["peak_traced"]/1e6))
+    return results
+
+
+def compare(base, new, threshold = 0.1, memory_threshold = 0.1, memory_floor = 1e6):
+    """ Prints the new/base ratios, returns the keys of the regressions. Memory changes below memory_floor bytes
+    are ignored (page granularity noise). """
+    regressions = []
+    print("{:>44} {:>12} {:>12} {:>8} {:>10}".format("benchmark", "base [ms]", "new [ms]", "time", "peak RSS"))
+    for k in sorted(set(base["results"]) & set(new["results"])):
+        b, n = base["results"][k], new["results"][k]
+        time_ratio = n["median"]/b["median"]
+        memory_ratio = None
+        if b.get("peak_rss") and n.get("peak_rss") is not None:
+            memory_ratio = n["peak_rss"]/b["peak_rss"]
+        slower = time_ratio > 1+threshold
+        larger = memory_ratio is not None and memory_ratio > 1+memory_threshold \
+            and n["peak_rss"]-b["peak_rss"] > memory_floor
+        flag = "  REGRESSION" if slower or larger else ""
+        if slower or larger:
+            regressions.append(k)
+        print("{:>44} {:>12.2f} {:>12.2f} {:>7.2f}x {:>9}{}".format(
+            k, 1e3*b["median"], 1e3*n["median"], time_ratio,
+            "{:.2f}x".format(memory_ratio) if memory_ratio is not None else "-", flag))
+    for k in sorted(set(base["results"]) ^ set(new["results"])):
+        print("{:>44} only in {}".format(k, "base" if k in base["results"] else "new"))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark suite of the hot paths")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--filter", default = None, help = "regular expression on the benchmark names")
+    run_parser.add_argument("--out", default = None, help = "JSON file for the results")
+    run_parser.add_argument("--device", default = "cpu")
+    run_parser.add_argument("--repeats", type = int, default = 5)
+    run_parser.add_argument("--max_time", type = float, default = 10.0, help = "seconds of timed calls per benchmark")
+    run_parser.add_argument("--list", action = "store_true", help = "only list the benchmarks")
+    run_parser.add_argument("--one", default = None, help = argparse.SUPPRESS)
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type = float, default = 0.1, help = "allowed relative slowdown")
+    compare_parser.add_argument("--memory_threshold", type = float, default = 0.1)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold, args.memory_threshold)
+        if regressions:
+            print("{} regression(s)".format(len(regressions)))
+            sys.exit(1)
+        sys.exit()
+
+    if args.list:
+        for name, params, _ in BENCHMARKS:
+            print(key(name, params))
+        sys.exit()
+    DEVICE = args.device
+    if args.one is not None:
+        name, params, setup = next(b for b in BENCHMARKS if key(b[0], b[1]) == args.one)
+        print(json.dumps(measure(setup, params, args.repeats, args.max_time)))
+        sys.exit()
+    results = {"meta": metadata(), "results": run_suite(args.filter, args.repeats, args.max_time)}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent = 1)
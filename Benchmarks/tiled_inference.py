@@ -0,0 +1,77 @@
+""" Inference.predict_tiled on masks larger than the 128x128 model input: time, tiles/s and peak memory per domain
+size and tile batch size, every configuration in a fresh process so the peaks do not mix. Memory is the growth of
+the resident set (VmHWM) over the state before the call, i.e. the output, the weight sum and one batch of tiles
+through the model. Also checks the blending: a model returning its input is reproduced exactly and a 128x128 mask
+gives Inference.predict.
+Run from this folder: python tiled_inference.py [--sizes 512 2048] [--batch_sizes 1 4 16] [--overlap 32] [--device cpu]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Model import UNet
+from Inference import load_model, predict, predict_tiled, tile_origins
+from Profiling import peak_rss
+
+
+class Affine(torch.nn.Module):
+    def forward(self, x):
+        return (2*x+1).unsqueeze(1)
+
+
+def check(model, device):
+    mask = np.random.default_rng(1).random((300, 700)).astype(np.float32)
+    for window in ['cosine', 'linear', 'uniform']:
+        assert np.allclose(predict_tiled(Affine(), mask, window = window, batch_size = 5), 2*mask+1, atol = 1e-5)
+    mask = (np.random.default_rng(2).random((128, 128)) > 0.9).astype(np.float32)
+    return np.abs(predict_tiled(model, mask, device = device)-predict(model, mask[None], device = device)[0]).max()
+
+
+def measure(model, size, batch_size, overlap, device):
+    mask = (np.random.default_rng(0).random((size, size)) > 0.9).astype(np.float32)
+    predict_tiled(model, mask[:256, :256], overlap = overlap, batch_size = batch_size, device = device) #warm up
+    before = peak_rss(reset = True)
+    t_0 = time.perf_counter()
+    predict_tiled(model, mask, overlap = overlap, batch_size = batch_size, device = device)
+    elapsed = time.perf_counter()-t_0
+    tiles = len(tile_origins(size, 128, 128-overlap))**2
+    return {'time': elapsed, 'tiles': tiles, 'memory': peak_rss()-before}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [512, 2048])
+    parser.add_argument("--batch_sizes", type = int, nargs = "+", default = [1, 4, 16])
+    parser.add_argument("--overlap", type = int, default = 32)
+    parser.add_argument("--device", default = "cpu")
+    parser.add_argument("--one", nargs = 3, type = int, help = argparse.SUPPRESS) #size batch_size overlap
+    parser.add_argument("--checkpoint", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        model = load_model(args.checkpoint, args.device)
+        print(json.dumps(measure(model, *args.one, args.device)))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = os.path.join(tmp, "checkpoint.pt")
+        torch.save({'model_state_dict': UNet().state_dict()}, checkpoint)
+        print("max |tiled-predict| on a 128x128 mask: {:.2e}".format(check(load_model(checkpoint, args.device),
+                                                                           args.device)))
+        print("{:>6} {:>6} {:>6} {:>10} {:>10} {:>14}".format("size", "batch", "tiles", "time [s]", "tiles/s",
+                                                               "memory [MB]"))
+        for size in args.sizes:
+            for batch_size in args.batch_sizes:
+                out = subprocess.run([sys.executable, __file__, "--one", str(size), str(batch_size), str(args.overlap),
+                                      "--checkpoint", checkpoint, "--device", args.device],
+                                     capture_output = True, text = True, check = True).stdout
+                r = json.loads(out.splitlines()[-1])
+                print("{:>6} {:>6} {:>6} {:>10.2f} {:>10.1f} {:>14.1f}".format(size, batch_size, r['tiles'], r['time'],
+                                                                              r['tiles']/r['time'], r['memory']/1e6))
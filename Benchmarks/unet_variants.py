@@ -0,0 +1,97 @@
+""" FLOPs, parameters and forward latency of UNet() against PaddedUNet() variants. With --data the models are also
+trained for --epochs on the dataset and the best test MSE is reported.
+Run from this folder: python unet_variants.py [--device cpu] [--data ../Data --epochs 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CNN"))
+from Model import UNet, PaddedUNet
+
+
+def count_flops(model, input_size = (1, 128, 128)):
+    """ Multiply-adds of the convolutions times two for one forward pass """
+    flops = []
+
+    def conv_hook(module, inp, out):
+        k = module.kernel_size[0]*module.kernel_size[1]*module.in_channels//module.groups
+        flops.append(2*k*out.numel())
+
+    def transpose_hook(module, inp, out):
+        k = module.kernel_size[0]*module.kernel_size[1]*module.out_channels
+        flops.append(2*k*inp[0].numel())
+
+    hooks = []
+    for m in model.modules():
+        if isinstance(m, nn.Conv2d):
+            hooks.append(m.register_forward_hook(conv_hook))
+        elif isinstance(m, nn.ConvTranspose2d):
+            hooks.append(m.register_forward_hook(transpose_hook))
+    with torch.inference_mode():
+        model(torch.zeros(input_size))
+    for h in hooks:
+        h.remove()
+    return sum(flops)
+
+
+def latency(model, batch_size, device, repeats = 5):
+    """ Best forward time in ms for a batch of 128x128 inputs """
+    x = torch.rand(batch_size, 128, 128, device = device)
+    best = float("inf")
+    with torch.inference_mode():
+        model(x)
+        for _ in range(repeats):
+            if device.startswith("cuda"):
+                torch.cuda.synchronize()
+            t_0 = time.perf_counter()
+            model(x)
+            if device.startswith("cuda"):
+                torch.cuda.synchronize()
+            best = min(best, time.perf_counter()-t_0)
+    return 1e3*best
+
+
+def test_mse(model, device, data, epochs):
+    """ Trains with Trainer.train and returns the best test loss """
+    from Dataloader import load_data
+    from Trainer import train
+    trainloader, testloader, _, _ = load_data(0.33, 10, device, mmap = True, path = os.path.abspath(data))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as out:
+        os.chdir(out)
+        try:
+            train(device, epochs, False, testloader, trainloader, model = model)
+            losses = torch.load("losses_{}.pt".format(torch.device(device)))
+        finally:
+            os.chdir(cwd)
+    return min(losses["TestLoss"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default = "cpu")
+    parser.add_argument("--data", default = None, help = "folder with input_images_10k.npy and target_images_10k.npy")
+    parser.add_argument("--epochs", type = int, default = 20)
+    args = parser.parse_args()
+
+    models = {
+        "UNet": lambda: UNet(),
+        "PaddedUNet(3, 64)": lambda: PaddedUNet(3, 64),
+        "PaddedUNet(3, 32)": lambda: PaddedUNet(3, 32),
+        "PaddedUNet(4, 32)": lambda: PaddedUNet(4, 32),
+    }
+    print("{:>18} {:>10} {:>10} {:>12} {:>12} {:>10}".format("model", "params", "GFLOPs", "bs=1 [ms]", "bs=16 [ms]",
+                                                            "test MSE"))
+    for name, make in models.items():
+        model = make().to(args.device).eval()
+        params = sum(p.numel() for p in model.parameters())
+        flops = count_flops(model.cpu())
+        model = model.to(args.device)
+        mse = test_mse(make(), args.device, args.data, args.epochs) if args.data else float("nan")
+        print("{:>18} {:>10} {:>10.2f} {:>12.1f} {:>12.1f} {:>10.4g}".format(name, params, flops/1e9,
+              latency(model, 1, args.device), latency(model, 16, args.device), mse))
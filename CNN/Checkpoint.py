@@ -0,0 +1,103 @@
+"""
+Checkpoints holding the full training state, written atomically on a background thread (Metrics.AsyncWriter).
+
+Every epoch is saved as <name>_epoch<NNNN>.pt and only the last keep_last of them are kept, the best epoch so
+far is also linked to <name>.pt (the file Eval.py and Inference.py read). A run that does not resume clears the
+checkpoints of name first (clear), so latest() always belongs to the current run. A checkpoint holds the model, optimizer
+and GradScaler states, the epoch, the loss history, the best epoch, the torch (cpu and cuda), numpy and python
+random states and the train/test split indices, so a resumed run continues exactly where it stopped: the same
+split, the same shuffling and augmentation draws and the same losses as an uninterrupted run (single process,
+with DDP the random states of rank 0 are restored on every rank).
+Checkpoints only hold tensors and plain Python values (the numpy random state and the split indices are stored as
+tensors), so readers can keep the default torch.load(weights_only = True).
+Checkpoints are loaded with torch.load(mmap = True), tensors are paged in on first use instead of read upfront.
+"""
+import glob
+import os
+import random
+import re
+import numpy as np
+import torch
+from Metrics import AsyncWriter, atomic_copy, remove
+
+
+def rng_state():
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    state = {
+        'torch': torch.get_rng_state(),
+        'numpy': [name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian],
+        'python': random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((name, np.asarray(keys).astype(np.uint32), pos, has_gauss, cached_gaussian))
+    random.setstate(state['python'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class CheckpointManager:
+    """ Saves and finds the checkpoints <directory>/<name>_epoch<NNNN>.pt and <directory>/<name>.pt (best) """
+    def __init__(self, name, directory = '.', keep_last = 3, writer = None):
+        self.name = name
+        self.directory = directory
+        self.keep_last = keep_last
+        self.writer = writer if writer is not None else AsyncWriter()
+        self.saved = None #epochs on disk or queued, oldest first
+
+    @property
+    def best_path(self):
+        return os.path.join(self.directory, "{}.pt".format(self.name))
+
+    def epoch_path(self, epoch):
+        return os.path.join(self.directory, "{}_epoch{:04d}.pt".format(self.name, epoch))
+
+    def epochs(self):
+        """ Epochs with a checkpoint on disk, ascending """
+        pattern = re.compile(re.escape(self.name)+r"_epoch(\d+)\.pt$")
+        found = [pattern.search(p) for p in glob.glob(os.path.join(self.directory, self.name+"_epoch*.pt"))]
+        return sorted(int(m.group(1)) for m in found if m)
+
+    def latest(self):
+        """ Path of the newest epoch checkpoint, falls back to the best checkpoint and None if there is neither """
+        epochs = self.epochs()
+        if epochs:
+            return self.epoch_path(epochs[-1])
+        return self.best_path if os.path.exists(self.best_path) else None
+
+    def clear(self):
+        """ Removes every epoch checkpoint and the best checkpoint of name, so a fresh run never resumes (or keeps)
+        the files of an earlier run """
+        for epoch in self.epochs():
+            remove(self.epoch_path(epoch))
+        remove(self.best_path)
+        self.saved = []
+
+    def save(self, state, epoch, best = False):
+        """ Queues state (tensors already snapshot) as the checkpoint of epoch, then the eviction of epochs older
+        than the last keep_last and, for best = True, the link to the best checkpoint. """
+        if self.saved is None:
+            self.saved = [e for e in self.epochs() if e < epoch] #from an earlier run, not yet evicted
+        path = self.epoch_path(epoch)
+        self.writer.save(state, path)
+        if best:
+            self.writer.submit(atomic_copy, path, self.best_path)
+        self.saved.append(epoch)
+        while len(self.saved) > self.keep_last:
+            self.writer.submit(remove, self.epoch_path(self.saved.pop(0)))
+
+    def load(self, path = None, map_location = 'cpu'):
+        """ State of the checkpoint path (default latest()), None if there is no checkpoint """
+        path = path or self.latest()
+        if path is None:
+            return None
+        return torch.load(path, map_location = map_location, mmap = True, weights_only = False)
+
+    def flush(self):
+        self.writer.flush()
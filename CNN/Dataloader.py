@@ -1,16 +1,26 @@
 import torch
 import numpy as np
-from sklearn.model_selection import train_test_split
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, DistributedSampler
 import torchvision.transforms.functional as TF
 import sys
+import os
+import hashlib
+import queue
+import tempfile
+import threading
+import time
 
 # Convert data to torch tensors
 class Data(Dataset):
-    def __init__(self, x, y, device):
-        self.x = torch.from_numpy(x.astype(np.float32)).to(device)
-        self.y = torch.from_numpy(y.astype(np.float32)).to(device)
-        self.len = self.x.shape[0]
+    """ The samples indices (default all) of x and y. Arrays are converted to float32 tensors on the device, tensors
+    already there are used as they are, so the train and test Data of load_data share one copy of the dataset and
+    only hold their indices. """
+    def __init__(self, x, y, device, indices = None):
+        self.x = to_tensor(x, device)
+        self.y = to_tensor(y, device)
+        self.indices = np.arange(len(self.x)) if indices is None else np.asarray(indices) #saved in the checkpoints
+        self.index = torch.from_numpy(self.indices.astype(np.int64)).to(device)
+        self.len = len(self.indices)
 
     def transforms(self, x, y):
         # Random horizontal flipping
@@ -26,6 +36,7 @@ class Data(Dataset):
 
 
     def __getitem__(self, index):
+        index = self.indices[index]
         input_image, target_image = self.x[index], self.y[index]
         x, y = self.transforms(input_image, target_image)
         return x,y
@@ -33,27 +44,376 @@ class Data(Dataset):
     def __len__(self):
         return self.len
 
-def load_data(split, batch_size, device):
-    if device == 'cpu':
-        path = '/Users/martinkristiansen/Desktop/Simula_2022/Data/'
-        input = np.load(path+"input_images_10k.npy")
-        target = np.load(path+"target_images_10k.npy")
 
-    if device == 'cuda:0':
-        input = np.load("input_images_10k.npy")
-        target = np.load("target_images_10k.npy")
+def to_tensor(array, device, chunk = 1024):
+    """ float32 tensor on the device, converted chunk by chunk so a (memory mapped) float64 array is never
+    copied as a whole """
+    if torch.is_tensor(array) and array.dtype == torch.float32 and array.device == torch.device(device):
+        return array
+    out = torch.empty(array.shape, dtype = torch.float32, device = device)
+    for start in range(0, len(array), chunk):
+        out[start:start+chunk] = torch.as_tensor(np.asarray(array[start:start+chunk], dtype = np.float32)).to(device)
+    return out
 
-    #split
-    x_train, x_test, y_train, y_test = train_test_split(input, target, test_size=split)
+
+def augment_batch(x, y, rotate = False, index = None):
+    """ Random horizontal and vertical flips of the samples index (default all) of a batch (B, H, W), applied to
+    inputs and targets alike. Every flip is applied to the whole batch once and kept per sample through a mask
+    (torch.where), so there is no host sync and the work does not depend on the drawn symmetries.
+    rotate = True also transposes half of the samples, together with the flips this gives all eight
+    symmetries of the square (90 degree rotations included), which leave the PDE problem invariant.
+    """
+    if index is not None:
+        x, y = x.index_select(0, index), y.index_select(0, index)
+    symmetry = torch.randint(8 if rotate else 4, (len(x),), device = x.device)
+    shape = (-1,)+(1,)*(x.dim()-1)
+    horizontal = (symmetry & 1).bool().view(shape)
+    vertical = (symmetry & 2).bool().view(shape)
+    transpose = (symmetry >= 4).view(shape)
+    out = []
+    for batch in (x, y):
+        batch = torch.where(horizontal, batch.flip(-1), batch)
+        batch = torch.where(vertical, batch.flip(-2), batch)
+        if rotate:
+            batch = torch.where(transpose, batch.transpose(-2, -1), batch)
+        out.append(batch)
+    return out[0], out[1]
+
+
+class DeviceBatchLoader:
+    """ Fast path replacing DataLoader for a Data set that already lives on the device. Batches are gathered
+    directly from the full tensors through the indices of the set (in order, or a slice of a device side
+    permutation when shuffling) and augmented with augment_batch while gathering, no per item __getitem__ or collate.
+    """
+    def __init__(self, data, batch_size, shuffle = True, augment = True, rotate = False):
+        self.dataset = data
+        self.x = data.x
+        self.y = data.y
+        self.index = data.index
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.augment = augment
+        self.rotate = rotate
+
+    def __iter__(self):
+        n = len(self.index)
+        index = self.index[torch.randperm(n, device = self.index.device)] if self.shuffle else self.index
+        for start in range(0, n, self.batch_size):
+            idx = index[start:start+self.batch_size]
+            if self.augment:
+                yield augment_batch(self.x, self.y, self.rotate, idx)
+            else:
+                yield self.x.index_select(0, idx), self.y.index_select(0, idx)
+
+    def __len__(self):
+        return -(-len(self.index)//self.batch_size)
+
+
+class MemmapData(Dataset):
+    """ Keeps the data on disk through np.load(mmap_mode = 'r'), only the indices of the split are stored.
+    Items are whole batches: index with an array of positions (use batch_size = None and a BatchSampler as
+    sampler), the batch is read, converted to float32, moved to the device and augmented with augment_batch.
+    The arrays are opened lazily so every DataLoader worker maps the files itself.
+    mmap = False reads the samples of the split into host memory once instead (in the stored dtype, compact for
+    the Packed.py format), DataLoader workers started by fork share them.
+    Subclasses for other file formats override load_arrays and read.
+    """
+    def __init__(self, input_path, target_path, indices, device, rotate = False, mmap = True):
+        self.input_path = input_path
+        self.target_path = target_path
+        self.indices = np.asarray(indices)
+        self.device = device
+        self.rotate = rotate
+        self.mmap = mmap
+        self.len = len(self.indices)
+        self.rows = self.indices #rows of x and y holding the samples
+        self.x = None
+        self.y = None
+        if not mmap:
+            rows = np.sort(self.indices)
+            x, y = self.load_arrays()
+            self.x, self.y = np.asarray(x[rows]), np.asarray(y[rows])
+            self.rows = np.searchsorted(rows, self.indices)
+
+    def load_arrays(self):
+        return np.load(self.input_path, mmap_mode = 'r'), np.load(self.target_path, mmap_mode = 'r')
+
+    def open(self):
+        if self.x is None:
+            self.x, self.y = self.load_arrays()
+
+    def read(self, rows):
+        """ float32 inputs and targets of the (sorted) rows """
+        return self.x[rows].astype(np.float32), self.y[rows].astype(np.float32)
+
+    def tensors(self, device, chunk = 1024):
+        """ All samples of the files (not only the split) as float32 tensors on the device, read chunk by chunk """
+        self.open()
+        x, y = None, None
+        for start in range(0, len(self.x), chunk):
+            x_chunk, y_chunk = self.read(np.arange(start, min(start+chunk, len(self.x))))
+            if x is None:
+                x = torch.empty((len(self.x), *x_chunk.shape[1:]), dtype = torch.float32, device = device)
+                y = torch.empty((len(self.x), *y_chunk.shape[1:]), dtype = torch.float32, device = device)
+            x[start:start+chunk] = torch.from_numpy(x_chunk).to(device)
+            y[start:start+chunk] = torch.from_numpy(y_chunk).to(device)
+        return x, y
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.mmap:
+            state['x'] = state['y'] = None #do not pickle the maps
+        return state
+
+    def transforms(self, x, y):
+        return augment_batch(x, y, self.rotate)
+
+    def __getitem__(self, index):
+        self.open()
+        single = np.ndim(index) == 0
+        idx = np.sort(self.rows[np.atleast_1d(index)]) #sorted reads are sequential on disk
+        x, y = self.read(idx)
+        x, y = self.transforms(torch.from_numpy(x).to(self.device), torch.from_numpy(y).to(self.device))
+        if single:
+            return x[0], y[0]
+        return x, y
+
+    def __len__(self):
+        return self.len
+
+
+class Prefetcher:
+    """ Wraps a loader of host batches (x, y) and hands them out on the device one step ahead. On cuda the next
+    batch is copied on a side stream (non_blocking, from pinned memory when the loader pins) while the current one
+    is computed on, elsewhere a background thread keeps up to depth batches ready. wait_time and batches
+    accumulate the time the training loop spent waiting for data and the number of batches handed out.
+    """
+    def __init__(self, loader, device, depth = 2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+        self.wait_time = 0.0
+        self.batches = 0
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    @property
+    def sampler(self):
+        return self.loader.sampler
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        batches = self._cuda_batches() if self.device.type == 'cuda' else self._thread_batches()
+        while True:
+            t_0 = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            self.wait_time += time.perf_counter()-t_0
+            self.batches += 1
+            yield batch
+
+    def _cuda_batches(self):
+        stream = torch.cuda.Stream(self.device)
+        batches = iter(self.loader)
+
+        def load():
+            batch = next(batches, None)
+            if batch is None:
+                return None
+            with torch.cuda.stream(stream):
+                return tuple(t.to(self.device, non_blocking = True) for t in batch)
+
+        batch = load()
+        while batch is not None:
+            current = torch.cuda.current_stream(self.device)
+            current.wait_stream(stream)
+            for t in batch:
+                t.record_stream(current) #the copies were allocated on the side stream
+            next_batch = load()
+            yield batch
+            batch = next_batch
+
+    def _thread_batches(self):
+        ready = queue.Queue(maxsize = self.depth)
+        stop = threading.Event()
+        done = object()
+
+        def work():
+            try:
+                for batch in self.loader:
+                    batch = tuple(t.to(self.device) for t in batch)
+                    while not stop.is_set():
+                        try:
+                            ready.put(batch, timeout = 0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if stop.is_set():
+                        return
+                ready.put(done)
+            except Exception as e:
+                ready.put(e)
+
+        thread = threading.Thread(target = work, daemon = True)
+        thread.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+
+def prefetch_loader(data, batch_size, device, shuffle = True, num_workers = 2):
+    """ Prefetcher over a DataLoader of whole batches of a host MemmapData built by num_workers worker processes
+    (pinned when the device is a gpu) """
+    sampler = RandomSampler(data) if shuffle else range(len(data))
+    loader = DataLoader(dataset=data, batch_size=None, sampler=BatchSampler(sampler, batch_size, drop_last=False),
+                        num_workers=num_workers, pin_memory=torch.device(device).type == 'cuda',
+                        persistent_workers=num_workers > 0)
+    return Prefetcher(loader, device)
+
+
+def dataset_hash(input_path, target_path, num_samples = 64):
+    """ Fingerprint of the data files: shapes, dtypes and num_samples evenly spaced samples of both arrays.
+    Cheap enough for every start up and changes whenever the data is regenerated. """
+    h = hashlib.sha256()
+    for p in (input_path, target_path):
+        array = np.load(p, mmap_mode = 'r')
+        h.update(repr((array.shape, array.dtype.str)).encode())
+        for i in np.unique(np.linspace(0, len(array)-1, num_samples).astype(int)):
+            h.update(np.ascontiguousarray(array[i]).tobytes())
+    return h.hexdigest()[:16]
+
+
+def load_split(input_path, target_path, split, seed = 0):
+    """ (train_idx, test_idx) with a fraction split of the samples for testing. The split is drawn once and saved
+    as sorted int32 indices with the dataset_hash in split_<split>_<seed>.npz next to the data, later calls
+    (training, resuming, Eval.py) read it back. Raises ValueError if the data changed since the split was made. """
+    split_path = os.path.join(os.path.dirname(input_path), "split_{}_{}.npz".format(split, seed))
+    digest = dataset_hash(input_path, target_path)
+    if os.path.exists(split_path):
+        with np.load(split_path) as f:
+            if str(f['hash']) != digest:
+                raise ValueError("{} was made for other data (hash {} != {}), remove it to draw a new split".format(
+                                 split_path, f['hash'], digest))
+            return f['train'], f['test']
+    n = np.load(input_path, mmap_mode = 'r').shape[0]
+    perm = np.random.default_rng(seed).permutation(n)
+    num_test = int(np.ceil(split*n)) #as train_test_split
+    train_idx = np.sort(perm[num_test:]).astype(np.int32)
+    test_idx = np.sort(perm[:num_test]).astype(np.int32)
+    #every DDP rank may get here at once: each writes its own temp file, the first rename wins (all draw the same
+    #split) and the file only appears complete
+    fd, tmp_path = tempfile.mkstemp(suffix = ".tmp", dir = os.path.dirname(split_path) or ".")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, train = train_idx, test = test_idx, hash = digest, split = split, seed = seed)
+    if os.path.exists(split_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, split_path)
+    return train_idx, test_idx
+
+
+def data_paths(device, path = None):
+    """ Input and target files in path, defaults to the local data folder on cpu and the working directory
+    on the cluster """
+    if path is None:
+        path = '/Users/martinkristiansen/Desktop/Simula_2022/Data/' if device == 'cpu' else ''
+    return os.path.join(path, "input_images_10k.npy"), os.path.join(path, "target_images_10k.npy")
+
+
+def load_data(split, batch_size, device, mmap = False, path = None, fast = False, rotate = False, indices = None,
+              seed = 0, prefetch = False, num_workers = 2, packed = False):
+    """ The train/test split is the persistent one of load_split (same test set in every run), indices =
+    (train_idx, test_idx) uses another, e.g. the 'split' of a checkpoint when resuming.
+    mmap = True keeps the data on disk, see MemmapData. Otherwise the dataset is converted once to a float32 tensor
+    on the device and both Data sets index into it.
+    fast = True returns DeviceBatchLoaders instead of DataLoaders for the in-memory data.
+    rotate = True adds random transposes to the flips, only for the batched paths (mmap, fast or prefetch).
+    prefetch = True keeps the data on the host (memory mapped with mmap = True), num_workers processes read and
+    augment the batches and a Prefetcher moves them to the device ahead of time, see prefetch_loader.
+    packed = True reads the bit packed copy written by Packed.py (PackedData) instead of the .npy files.
+    """
+    input_path, target_path = data_paths(device, path)
+    if packed:
+        from Packed import PackedData, packed_dir
+        directory = packed_dir(input_path)
+        input_path, target_path = os.path.join(directory, "masks.npy"), os.path.join(directory, "targets.npy")
+        dataset = lambda idx, device, mmap = True: PackedData(directory, idx, device, rotate, mmap)
+    else:
+        dataset = lambda idx, device, mmap = True: MemmapData(input_path, target_path, idx, device, rotate, mmap)
+    if indices is None:
+        train_idx, test_idx = load_split(input_path, target_path, split, seed)
+    else:
+        train_idx, test_idx = (np.asarray(i) for i in indices)
+
+    if prefetch:
+        train_data = dataset(train_idx, 'cpu', mmap)
+        test_data = dataset(test_idx, 'cpu', mmap)
+        train_dataloader = prefetch_loader(train_data, batch_size, device, num_workers = num_workers)
+        test_dataloader = prefetch_loader(test_data, batch_size, device, num_workers = num_workers)
+        return train_dataloader, test_dataloader, train_data, test_data
+
+    if mmap:
+        train_data = dataset(train_idx, device)
+        train_dataloader = DataLoader(dataset=train_data, batch_size=None,
+                                      sampler=BatchSampler(RandomSampler(train_data), batch_size, drop_last=False))
+        test_data = dataset(test_idx, device)
+        test_dataloader = DataLoader(dataset=test_data, batch_size=None,
+                                     sampler=BatchSampler(RandomSampler(test_data), batch_size, drop_last=False))
+        return train_dataloader, test_dataloader, train_data, test_data
+
+    if packed:
+        input, target = dataset(train_idx, 'cpu').tensors(device)
+    else:
+        input = to_tensor(np.load(input_path, mmap_mode = 'r'), device)
+        target = to_tensor(np.load(target_path, mmap_mode = 'r'), device)
 
     # Use troch.utils functionality to initiate data
-    train_data = Data(x_train, y_train, device)
+    train_data = Data(input, target, device, train_idx)
+    test_data = Data(input, target, device, test_idx)
+    if fast:
+        train_dataloader = DeviceBatchLoader(train_data, batch_size, rotate = rotate)
+        test_dataloader = DeviceBatchLoader(test_data, batch_size, rotate = rotate)
+        return train_dataloader, test_dataloader, train_data, test_data
+
     train_dataloader = DataLoader(dataset=train_data, batch_size=batch_size, shuffle=True)
-    test_data = Data(x_test, y_test, device)
     test_dataloader = DataLoader(dataset=test_data, batch_size=batch_size, shuffle=True)
 
     return train_dataloader, test_dataloader, train_data, test_data
 
+def load_data_distributed(split, batch_size, device, rank, world_size, path = None, rotate = False, seed = 0):
+    """ Loaders for one rank of a DistributedDataParallel run. Every rank reads the same load_split and keeps
+    the data in MemmapData, a DistributedSampler hands each rank its own part of the indices per epoch so only
+    that shard is read, the arrays are never replicated in every process (the page cache is shared).
+    batch_size is per rank. Call set_epoch on the samplers (Trainer.train does) to reshuffle every epoch.
+    The test set is split without padding, so ranks may hold one sample more or less than others.
+    """
+    input_path, target_path = data_paths(device, path)
+    train_idx, test_idx = load_split(input_path, target_path, split, seed)
+    train_data = MemmapData(input_path, target_path, train_idx, device, rotate)
+    train_sampler = DistributedSampler(train_data, world_size, rank, shuffle=True, seed=seed)
+    train_dataloader = DataLoader(dataset=train_data, batch_size=None,
+                                  sampler=BatchSampler(train_sampler, batch_size, drop_last=False))
+    test_data = MemmapData(input_path, target_path, test_idx, device, rotate)
+    #every test sample on exactly one rank, DistributedSampler would pad with duplicates to equal the ranks
+    test_sampler = range(rank, len(test_data), world_size)
+    test_dataloader = DataLoader(dataset=test_data, batch_size=None,
+                                 sampler=BatchSampler(test_sampler, batch_size, drop_last=False))
+    return train_dataloader, test_dataloader, train_data, test_data
+
+
 if __name__ == "__main__":
     #check if its working properly
     test_data = load_data(0.33, 10)[1]
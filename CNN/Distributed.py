@@ -0,0 +1,79 @@
+"""
+Multi-process data parallel training with Trainer.train. One process per rank is spawned, every rank joins a
+torch.distributed process group (gloo by default, so it also runs on cpu only nodes, nccl is faster on gpus),
+reads its own shard of the memory mapped data (Dataloader.load_data_distributed) and trains a
+DistributedDataParallel copy of the model. Losses are averaged over the ranks, rank 0 writes the losses and
+checkpoints under the usual names, so Eval.py and Inference.py work unchanged.
+
+Usage: python Distributed.py --world_size 4 --epochs 100 --batch_size 10 --data ../Data [--device cuda]
+batch_size is per rank, the global batch is world_size*batch_size.
+"""
+import argparse
+import os
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from Dataloader import load_data_distributed
+from Trainer import train
+
+
+def setup(rank, world_size, backend = 'gloo', port = 29500):
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(port))
+    dist.init_process_group(backend, rank = rank, world_size = world_size)
+
+
+def cleanup():
+    dist.destroy_process_group()
+
+
+def rank_device(rank, device):
+    """ cuda:rank for device = 'cuda', otherwise device """
+    return 'cuda:{}'.format(rank % torch.cuda.device_count()) if device == 'cuda' else device
+
+
+def worker(rank, world_size, args, model_fn = None):
+    """ Entry point of one spawned rank. On cpu the cores are split between the ranks. """
+    setup(rank, world_size, args.backend, args.port)
+    try:
+        device = rank_device(rank, args.device)
+        if device == 'cpu':
+            torch.set_num_threads(max(1, (os.cpu_count() or 1)//world_size))
+        torch.manual_seed(args.seed) #same initial weights on every rank (DDP also broadcasts them from rank 0)
+        trainloader, testloader, _, _ = load_data_distributed(args.split, args.batch_size, device, rank, world_size,
+                                                              path = args.data, seed = args.seed)
+        train(device, args.epochs, args.checkpoint, testloader, trainloader, amp = args.amp,
+              model = model_fn() if model_fn is not None else None, objective = args.objective,
+              instrument = args.instrument, profile = args.profile)
+    finally:
+        cleanup()
+
+
+def launch(world_size, args, model_fn = None):
+    """ Spawns world_size ranks and waits for them, model_fn must be picklable (a module level function) """
+    mp.spawn(worker, args = (world_size, args, model_fn), nprocs = world_size, join = True)
+
+
+def parser():
+    parser = argparse.ArgumentParser(description = "Distributed data parallel training of the UNet")
+    parser.add_argument("--world_size", type = int, default = 2)
+    parser.add_argument("--epochs", type = int, default = 100)
+    parser.add_argument("--batch_size", type = int, default = 10, help = "per rank")
+    parser.add_argument("--split", type = float, default = 0.33)
+    parser.add_argument("--data", default = None, help = "folder with input_images_10k.npy and target_images_10k.npy")
+    parser.add_argument("--device", default = "cpu", help = "cpu or cuda (one gpu per rank)")
+    parser.add_argument("--backend", default = "gloo")
+    parser.add_argument("--port", type = int, default = 29500)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--amp", action = "store_true")
+    parser.add_argument("--objective", default = "mse", help = "mse, sinkhorn or mse+sinkhorn")
+    parser.add_argument("--checkpoint", action = "store_true", help = "resume from checkpoint_<device>.pt")
+    parser.add_argument("--instrument", action = "store_true", help = "per phase timings in train_log_<device>.jsonl")
+    parser.add_argument("--profile", type = int, nargs = 2, default = None, metavar = ("FIRST_STEP", "NUM_STEPS"),
+                        help = "torch.profiler trace of these steps on rank 0")
+    return parser
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+    launch(args.world_size, args)
@@ -0,0 +1,186 @@
+"""
+Batched inference with a trained checkpoint, the UNet as a fast replacement for the Gridap solve.
+The checkpoint is loaded once and masks are predicted in batches under torch.inference_mode, either from an
+array (e.g. np.load(..., mmap_mode = 'r')) or from any iterable of 128x128 masks.
+Masks of larger domains are predicted tile by tile with predict_tiled (sliding window, blended overlaps). Each tile
+only sees its own part of the graph, the model has no information about the rest (e.g. the distances to the
+root), so tiles far from the root are only as good as the local structure explains the field.
+
+Usage: python Inference.py checkpoint_cuda-0.pt input_images.npy predictions.npy --batch_size 64
+       python Inference.py checkpoint_cuda-0.pt large_masks.npy predictions.npy --tiled --overlap 32
+"""
+import argparse
+import itertools
+import numpy as np
+import torch
+from Model import UNet, PaddedUNet
+
+
+def load_model(checkpoint, device = 'cpu', model = None, compile = False, torchscript = False):
+    """ Model in eval mode with the weights of a checkpoint written by Trainer.train. model defaults to UNet().
+    torchscript = True returns a traced and frozen TorchScript module, compile = True wraps it in torch.compile. """
+    if model is None:
+        model = UNet()
+    state = torch.load(checkpoint, map_location = torch.device(device))
+    model.load_state_dict(state['model_state_dict'])
+    model = model.to(device).eval()
+    if torchscript:
+        with torch.inference_mode():
+            model = torch.jit.freeze(torch.jit.trace(model, torch.zeros(1, 128, 128, device = device)))
+    if compile:
+        model = torch.compile(model)
+    return model
+
+
+def _batches(masks, batch_size):
+    """ Batches of masks from an array like (sliced, so memory maps are read one batch at a time) or an iterable """
+    if hasattr(masks, '__len__') and hasattr(masks, '__getitem__'):
+        for start in range(0, len(masks), batch_size):
+            yield masks[start:start+batch_size]
+        return
+    masks = iter(masks)
+    while True:
+        batch = list(itertools.islice(masks, batch_size))
+        if not batch:
+            return
+        yield np.stack(batch)
+
+
+def predict_batches(model, masks, batch_size = 64, device = 'cpu'):
+    """ Yields (start, predictions) with predictions a float32 array (B, H, W) for masks[start:start+B] """
+    start = 0
+    with torch.inference_mode():
+        for batch in _batches(masks, batch_size):
+            x = torch.as_tensor(np.asarray(batch, dtype = np.float32)).to(device, non_blocking = True)
+            pred = model(x)[:, 0].float().cpu().numpy()
+            yield start, pred
+            start += len(pred)
+
+
+def predict(model, masks, batch_size = 64, device = 'cpu'):
+    """ Predictions (N, H, W) for all masks """
+    return np.concatenate([pred for _, pred in predict_batches(model, masks, batch_size, device)])
+
+
+def check_overlap(tile, overlap):
+    if not 0 <= overlap < tile:
+        raise ValueError("the tile overlap must be in [0, {}) for {}x{} tiles, got {}".format(tile, tile, tile, overlap))
+
+
+def tile_window(tile = 128, overlap = 32, window = 'cosine'):
+    """ (tile, tile) blending weights, 1 in the middle and tapering to small positive values over the overlap
+    at every side: 'cosine' (raised cosine), 'linear' or 'uniform' (plain averaging of the overlaps). With an
+    overlap above tile/2 the two ramps meet and every pixel takes the lower one. """
+    check_overlap(tile, overlap)
+    if overlap == 0 or window == 'uniform':
+        return np.ones((tile, tile), dtype = np.float32)
+    k = np.arange(tile)
+    t = np.minimum(np.minimum(k, tile-1-k)+0.5, overlap)/overlap #distance to the nearest edge, 1 past the ramp
+    w = (0.5-0.5*np.cos(np.pi*t) if window == 'cosine' else t).astype(np.float32)
+    return np.outer(w, w)
+
+
+def tile_origins(size, tile, stride):
+    """ Start of every tile along an axis of length size, the last tile ends at the border """
+    origins = list(range(0, max(size-tile, 0)+1, stride))
+    if origins[-1]+tile < size:
+        origins.append(size-tile)
+    return origins
+
+
+def predict_tiled(model, mask, tile = 128, overlap = 32, batch_size = 16, device = 'cpu', window = 'cosine',
+                  out = None):
+    """ Prediction (H, W) for a mask of any size larger than the model input: the mask is cut into tile x tile
+    tiles overlapping by overlap pixels, batch_size tiles at a time are predicted and the overlaps are blended
+    with tile_window. Masks smaller than a tile are zero padded (empty tissue). Besides the output only one batch
+    of tiles is held, so memory is bounded by batch_size. mask can be a memory map, out an array (e.g. a memory
+    map) to write the float32 prediction into. """
+    check_overlap(tile, overlap)
+    H, W = mask.shape
+    if H < tile or W < tile:
+        padded = np.zeros((max(H, tile), max(W, tile)), dtype = np.float32)
+        padded[:H, :W] = mask
+        pred = predict_tiled(model, padded, tile, overlap, batch_size, device, window)[:H, :W]
+        if out is None:
+            return pred
+        out[...] = pred
+        return out
+    stride = tile-overlap
+    weights = tile_window(tile, overlap, window)
+    total = np.zeros((H, W), dtype = np.float32)
+    if out is None:
+        out = np.zeros((H, W), dtype = np.float32)
+    else:
+        out[...] = 0
+    origins = [(i, j) for i in tile_origins(H, tile, stride) for j in tile_origins(W, tile, stride)]
+    with torch.inference_mode():
+        for start in range(0, len(origins), batch_size):
+            batch = origins[start:start+batch_size]
+            x = np.stack([mask[i:i+tile, j:j+tile] for i, j in batch]).astype(np.float32)
+            pred = model(torch.from_numpy(x).to(device, non_blocking = True))[:, 0].float().cpu().numpy()
+            for (i, j), p in zip(batch, pred):
+                out[i:i+tile, j:j+tile] += weights*p
+                total[i:i+tile, j:j+tile] += weights
+    out /= total
+    return out
+
+
+def predict_to_file(model, input_path, output_path, batch_size = 64, device = 'cpu', tiled = False, overlap = 32):
+    """ Reads the masks in input_path (.npy) through a memory map and writes every batch of predictions to the
+    .npy file output_path as soon as it is computed. tiled = True predicts every mask with predict_tiled, for
+    masks larger than 128x128, batch_size is then the number of tiles per batch. """
+    if tiled:
+        check_overlap(128, overlap)
+    masks = np.load(input_path, mmap_mode = 'r')
+    out = np.lib.format.open_memmap(output_path, mode = 'w+', dtype = np.float32, shape = masks.shape)
+    if tiled:
+        for k in range(len(masks)):
+            predict_tiled(model, masks[k], overlap = overlap, batch_size = batch_size, device = device, out = out[k])
+    else:
+        for start, pred in predict_batches(model, masks, batch_size, device):
+            out[start:start+len(pred)] = pred
+    out.flush()
+    return output_path
+
+
+def export_torchscript(model, path, device = 'cpu'):
+    """ Saves a traced TorchScript module, load it with torch.jit.load without the model code """
+    with torch.inference_mode():
+        torch.jit.trace(model.eval(), torch.zeros(1, 128, 128, device = device)).save(path)
+    return path
+
+
+def export_onnx(model, path, device = 'cpu'):
+    """ Saves an ONNX graph with a dynamic batch dimension, needs the onnx package """
+    torch.onnx.export(model.eval(), torch.zeros(1, 128, 128, device = device), path, input_names = ['masks'],
+                      output_names = ['predictions'], dynamic_axes = {'masks': {0: 'batch'}, 'predictions': {0: 'batch'}})
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Predict concentration fields for binary masks")
+    parser.add_argument("checkpoint")
+    parser.add_argument("input", help = ".npy file with masks (N, 128, 128)")
+    parser.add_argument("output", help = ".npy file for the predictions")
+    parser.add_argument("--batch_size", type = int, default = 64)
+    parser.add_argument("--device", default = "cpu")
+    parser.add_argument("--padded", action = "store_true", help = "checkpoint of a PaddedUNet()")
+    parser.add_argument("--tiled", action = "store_true", help = "masks larger than 128x128, predicted in tiles")
+    parser.add_argument("--overlap", type = int, default = 32, help = "of the tiles with --tiled")
+    parser.add_argument("--compile", action = "store_true")
+    parser.add_argument("--torchscript", action = "store_true")
+    parser.add_argument("--export_torchscript", default = None, help = "also save a TorchScript module here")
+    parser.add_argument("--export_onnx", default = None, help = "also save an ONNX graph here")
+    args = parser.parse_args()
+    if args.tiled and not 0 <= args.overlap < 128:
+        parser.error("--overlap must be in [0, 128)")
+
+    model = load_model(args.checkpoint, args.device, PaddedUNet() if args.padded else None,
+                       compile = args.compile, torchscript = args.torchscript)
+    if args.export_torchscript:
+        export_torchscript(load_model(args.checkpoint, args.device, PaddedUNet() if args.padded else None),
+                           args.export_torchscript, args.device)
+    if args.export_onnx:
+        export_onnx(load_model(args.checkpoint, args.device, PaddedUNet() if args.padded else None),
+                    args.export_onnx, args.device)
+    predict_to_file(model, args.input, args.output, args.batch_size, args.device, args.tiled, args.overlap)
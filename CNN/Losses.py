@@ -0,0 +1,151 @@
+"""
+Training objectives for Trainer.train. Besides the MSE, the predicted and target 128x128 fields can be compared as
+measures on the image grid with a debiased Sinkhorn divergence (an entropic Wasserstein-2 distance), which
+penalises mass that is put in the wrong place by how far it is off instead of pixel by pixel.
+
+SinkhornLoss works directly on the grid, no points are sampled (compare draw_samples in Wasserstein.py): the
+Gaussian kernel of the grid is separable, so every Sinkhorn update is a log-sum-exp along the rows followed by one
+along the columns, batched over the images. blur is the length scale in units of the image side below which
+the transport is smoothed out, scaling the factor by which blur is decreased per iteration of the
+epsilon-scaling (fewer iterations for smaller values, geomloss uses the same parameters). The coarse temperatures run on
+downsampled images, so only the final step pays for the full grid. backend = 'geomloss' (opt in, geomloss must be
+installed) uses its multiscale sinkhorn_images solver instead of the pure torch one, which needs a power of two
+image size. The default is always 'torch', so the loss values do not depend on what is installed.
+"""
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+try:
+    from geomloss.sinkhorn_images import sinkhorn_divergence as geomloss_images
+except ImportError:
+    geomloss_images = None
+
+
+def as_measures(x, floor = 1e-12):
+    """ Non negative (N, H, W) weights summing to one per image, from fields (N, H, W) or (N, 1, H, W) """
+    x = x.reshape(-1, *x.shape[-2:]).float().clamp(min = 0) + floor
+    return x / x.sum(dim = (-2, -1), keepdim = True)
+
+
+def epsilon_schedule(diameter, blur, scaling, p = 2):
+    """ Decreasing temperatures diameter**p ... blur**p with ratio scaling**p, as geomloss """
+    return [diameter**p] + [np.exp(e) for e in np.arange(p*np.log(diameter), p*np.log(blur), p*np.log(scaling))] \
+        + [blur**p]
+
+
+def softmin(eps, C, h):
+    """ -eps*log(sum_j exp(h_j - C(x_i, x_j)/eps)) on the grid, h (N, H, W), with the separable cost
+    C = C_rows + C_cols given by the (H, H) and (W, W) matrices C """
+    C_rows, C_cols = C
+    h = torch.logsumexp(h.unsqueeze(-2) - C_cols/eps, dim = -1) #along the rows of each image
+    h = torch.logsumexp(h.transpose(-2, -1).unsqueeze(-2) - C_rows/eps, dim = -1).transpose(-2, -1)
+    return -eps*h
+
+
+def grid_cost(shape, device, dtype):
+    """ (H, H) and (W, W) matrices of |x_i - x_j|**2/2 for the pixel centers x_i = (i+0.5)/n """
+    C = []
+    for n in shape:
+        x = (torch.arange(n, device = device, dtype = dtype)+0.5)/n
+        C.append((x[:, None]-x[None, :])**2/2)
+    return tuple(C)
+
+
+def pyramid(a, min_size = 16):
+    """ a and its 2x2 sum pooled versions down to min_size, finest first """
+    levels = [a]
+    while all(n % 2 == 0 and n//2 >= min_size for n in levels[-1].shape[-2:]):
+        levels.append(4*F.avg_pool2d(levels[-1].unsqueeze(1), 2).squeeze(1))
+    return levels
+
+
+def sinkhorn_divergence(a, b, blur = 0.02, scaling = 0.5):
+    """ Debiased Sinkhorn divergence S(a, b) with cost |x-y|**2/2 for measures a, b (N, H, W) on the pixel centers
+    of [0, 1]**2, one value per image. Log domain, symmetric updates with epsilon-scaling. The large temperatures
+    run on a pyramid of pooled images (one pixel per blur length) and the potentials are upsampled when the
+    scale gets finer, the final extrapolation always runs at full resolution. The potentials are computed
+    without autograd and the final extrapolation is differentiated (its gradient is the gradient of S). """
+    a_levels, b_levels = pyramid(a), pyramid(b)
+    eps_list = epsilon_schedule(np.sqrt(2), blur, scaling)
+
+    def level(k):
+        needed = 1/np.sqrt(eps_list[k])
+        coarse = [l for l, x in enumerate(a_levels) if min(x.shape[-2:]) >= needed]
+        return coarse[-1] if coarse else 0
+
+    with torch.no_grad():
+        current = level(0)
+        a_log, b_log = a_levels[current].log(), b_levels[current].log()
+        C = grid_cost(a_log.shape[-2:], a.device, a.dtype)
+        eps = eps_list[0]
+        f_ba, g_ab = softmin(eps, C, b_log), softmin(eps, C, a_log)
+        f_aa, g_bb = softmin(eps, C, a_log), softmin(eps, C, b_log)
+        for k, eps in enumerate(eps_list):
+            if level(k) != current:
+                current = level(k)
+                a_log, b_log = a_levels[current].log(), b_levels[current].log()
+                C = grid_cost(a_log.shape[-2:], a.device, a.dtype)
+                f_ba, g_ab, f_aa, g_bb = (F.interpolate(f.unsqueeze(1), size = a_log.shape[-2:], mode = 'bilinear',
+                                          align_corners = False).squeeze(1) for f in (f_ba, g_ab, f_aa, g_bb))
+            ft_ba, gt_ab = softmin(eps, C, b_log + g_ab/eps), softmin(eps, C, a_log + f_ba/eps)
+            ft_aa, gt_bb = softmin(eps, C, a_log + f_aa/eps), softmin(eps, C, b_log + g_bb/eps)
+            f_ba, g_ab = (f_ba + ft_ba)/2, (g_ab + gt_ab)/2
+            f_aa, g_bb = (f_aa + ft_aa)/2, (g_bb + gt_bb)/2
+
+    eps = eps_list[-1]
+    a_log, b_log = a.log(), b.log()
+    if current != 0:
+        C = grid_cost(a_log.shape[-2:], a.device, a.dtype)
+        f_ba, g_ab, f_aa, g_bb = (F.interpolate(f.unsqueeze(1), size = a_log.shape[-2:], mode = 'bilinear',
+                                  align_corners = False).squeeze(1) for f in (f_ba, g_ab, f_aa, g_bb))
+    f_ba, g_ab = softmin(eps, C, b_log + g_ab/eps), softmin(eps, C, a_log + f_ba/eps)
+    f_aa, g_bb = softmin(eps, C, a_log + f_aa/eps), softmin(eps, C, b_log + g_bb/eps)
+    return ((a*(f_ba - f_aa)).sum(dim = (-2, -1)) + (b*(g_ab - g_bb)).sum(dim = (-2, -1)))
+
+
+class SinkhornLoss(nn.Module):
+    """ Mean Sinkhorn divergence between the normalised prediction and target fields of a batch, see the module
+    docstring. Inputs (N, H, W) or (N, 1, H, W). """
+    def __init__(self, blur = 0.02, scaling = 0.5, backend = 'torch'):
+        super().__init__()
+        if backend not in ('torch', 'geomloss'):
+            raise ValueError("unknown backend {}, use 'torch' or 'geomloss'".format(backend))
+        if backend == 'geomloss' and geomloss_images is None:
+            raise ImportError("backend = 'geomloss' needs geomloss (pip install geomloss)")
+        self.blur = blur
+        self.scaling = scaling
+        self.backend = backend
+
+    def forward(self, pred, target):
+        a, b = as_measures(pred), as_measures(target)
+        if self.backend == 'geomloss':
+            return geomloss_images(a.unsqueeze(1), b.unsqueeze(1), p = 2, blur = self.blur,
+                                   scaling = self.scaling).mean()
+        return sinkhorn_divergence(a, b, self.blur, self.scaling).mean()
+
+
+class MSESinkhornLoss(nn.Module):
+    """ MSE plus weight times the SinkhornLoss, the Sinkhorn term only sees the normalised fields so the MSE keeps
+    the total concentration in place """
+    def __init__(self, weight = 1.0, **kwargs):
+        super().__init__()
+        self.weight = weight
+        self.mse = nn.MSELoss()
+        self.sinkhorn = SinkhornLoss(**kwargs)
+
+    def forward(self, pred, target):
+        return self.mse(pred, target) + self.weight*self.sinkhorn(pred, target)
+
+
+def make_loss(objective = 'mse', **kwargs):
+    """ Loss module for train(objective = ...): 'mse', 'sinkhorn' or 'mse+sinkhorn', kwargs go to SinkhornLoss
+    (blur, scaling, backend) and MSESinkhornLoss (weight) """
+    if objective == 'mse':
+        return nn.MSELoss()
+    if objective == 'sinkhorn':
+        return SinkhornLoss(**kwargs)
+    if objective == 'mse+sinkhorn':
+        return MSESinkhornLoss(**kwargs)
+    raise ValueError("unknown objective {}, use 'mse', 'sinkhorn' or 'mse+sinkhorn'".format(objective))
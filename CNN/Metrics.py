@@ -0,0 +1,114 @@
+""" Helpers keeping host/device synchronisation and disk writes out of the training loop. """
+import os
+import queue
+import shutil
+import threading
+import time
+import torch
+import torch.distributed as dist
+
+
+class RunningMean:
+    """ Mean of scalar losses accumulated on the device, the only host sync happens when the mean is read.
+    distributed = True averages over all ranks of the process group when the mean is read, so every rank has
+    to call compute() at the same point. update(value, weight) counts value weight times, e.g. the mean loss of a
+    batch with its number of samples, so the mean is over samples whatever the batch sizes on the ranks. """
+    def __init__(self, device, distributed = False):
+        self.device = device
+        self.distributed = distributed
+        self.reset()
+
+    def reset(self):
+        self.sum = torch.zeros((), device = self.device)
+        self.count = 0
+
+    def update(self, value, weight = 1):
+        self.sum += value.detach().float()*weight
+        self.count += weight
+
+    def compute(self):
+        if self.distributed:
+            total = torch.stack([self.sum, torch.tensor(float(self.count), device = self.device)])
+            dist.all_reduce(total)
+            return (total[0]/total[1].clamp(min = 1)).item()
+        return (self.sum/max(self.count, 1)).item()
+
+
+def snapshot(obj):
+    """ Copy of the tensors in a (nested) state dict, taken on the device without a host sync. Needed before
+    handing a state dict to AsyncWriter since training keeps updating the parameters in place. """
+    if torch.is_tensor(obj):
+        return obj.detach().clone()
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+def atomic_save(obj, path):
+    """ torch.save to a temporary name and rename, a crash never leaves a half written file behind """
+    torch.save(obj, path+".tmp")
+    os.replace(path+".tmp", path)
+
+
+def atomic_copy(src, dst):
+    """ Hard link (or copy) of src under the name dst, replacing dst atomically """
+    if os.path.exists(dst+".tmp"):
+        os.remove(dst+".tmp")
+    try:
+        os.link(src, dst+".tmp")
+    except OSError:
+        shutil.copyfile(src, dst+".tmp")
+    os.replace(dst+".tmp", dst)
+
+
+def remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class AsyncWriter:
+    """ torch.save on a background thread with atomic_save. Jobs run in submission order, so files can also be
+    copied or removed after they are written (submit). Call close() (or flush()) before reading the files.
+    busy is the total time spent in the jobs so far, in seconds. """
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.error = None
+        self.busy = 0.0
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                fn, args = item
+                t_0 = time.perf_counter()
+                fn(*args)
+                self.busy += time.perf_counter()-t_0
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, *args):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((fn, args))
+
+    def save(self, obj, path):
+        self.submit(atomic_save, obj, path)
+
+    def flush(self):
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
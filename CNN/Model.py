@@ -10,18 +10,17 @@ This yields 1.8 mill learnable parameters and an output shape before interpolati
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torchvision
 import matplotlib.pyplot as plt
 from torch.utils.data import Dataset, DataLoader
 
 class Block(nn.Module):
     """ The block operation uses two 3x3 convolutions, each followed by a ReLU activation """
-    def __init__(self, in_ch, out_ch):
+    def __init__(self, in_ch, out_ch, padding = 0):
         super().__init__()
-        self.conv1 = nn.Conv2d(in_ch, out_ch, 3)#), padding = 'same')
+        self.conv1 = nn.Conv2d(in_ch, out_ch, 3, padding = padding)
         self.relu  = nn.ReLU()
         torch.nn.BatchNorm2d(out_ch)
-        self.conv2 = nn.Conv2d(out_ch, out_ch, 3)#, padding = 'same')
+        self.conv2 = nn.Conv2d(out_ch, out_ch, 3, padding = padding)
         torch.nn.BatchNorm2d(out_ch)
 
     def forward(self, x):
@@ -37,9 +36,9 @@ class Encoder(nn.Module):
     block -> maxpool
     4. torch.Size([1, 256, 12, 12])
     """
-    def __init__(self, chs=(1, 64, 128, 256)):
+    def __init__(self, chs=(1, 64, 128, 256), padding = 0):
         super().__init__()
-        self.enc_blocks = nn.ModuleList([Block(chs[i], chs[i+1]) for i in range(len(chs)-1)])
+        self.enc_blocks = nn.ModuleList([Block(chs[i], chs[i+1], padding) for i in range(len(chs)-1)])
         self.pool       = nn.MaxPool2d(2)
 
     def forward(self, x):
@@ -64,11 +63,11 @@ class Decoder(nn.Module):
     3. torch.Size([batch_size, 64, 88, 88])
     """
 
-    def __init__(self, chs=(256, 128, 64)):
+    def __init__(self, chs=(256, 128, 64), padding = 0):
         super().__init__()
         self.chs        = chs
         self.upconvs    = nn.ModuleList([nn.ConvTranspose2d(chs[i], chs[i+1], kernel_size=2, stride=2) for i in range(len(chs)-1)])
-        self.dec_blocks = nn.ModuleList([Block(chs[i], chs[i+1]) for i in range(len(chs)-1)])
+        self.dec_blocks = nn.ModuleList([Block(chs[i], chs[i+1], padding) for i in range(len(chs)-1)])
 
     def forward(self, x, encoder_features):
         for i in range(len(self.chs)-1):
@@ -80,9 +79,19 @@ class Decoder(nn.Module):
         return x
 
     def crop(self, enc_ftrs, x):
-        _, _, H, W = x.shape
-        enc_ftrs   = torchvision.transforms.CenterCrop([H, W])(enc_ftrs)
-        return enc_ftrs
+        return center_crop(enc_ftrs, x)
+
+
+def center_crop(enc_ftrs, x):
+    """ Crops enc_ftrs to the spatial size of x with the offsets of torchvision's CenterCrop, as a slice so no
+    transform module is built per call and the model can be traced (a no-op view for padded convolutions). """
+    h, w = int(enc_ftrs.shape[-2]), int(enc_ftrs.shape[-1])
+    H, W = int(x.shape[-2]), int(x.shape[-1])
+    top  = int(round((h-H)/2.0))
+    left = int(round((w-W)/2.0))
+    return enc_ftrs[..., top:top+H, left:left+W]
+
+torch.fx.wrap('center_crop') #a leaf for FX tracing (Quantize.py), the crop needs concrete shapes
 
 
 class UNet(nn.Module):
@@ -101,6 +110,28 @@ class UNet(nn.Module):
         return out
 
 
+class PaddedUNet(nn.Module):
+    """
+    UNet with 'same' padded convolutions (padding = 1 for the 3x3 kernels, an integer so the int8 kernels of
+    Quantize.py accept it), the spatial size is kept end to end so the skip connections are not
+    cropped and the output needs no interpolation. depth is the number of encoder blocks and width the channels
+    of the first block, doubled on every level. depth = 3, width = 64 has the channels and parameter count of
+    UNet(). The input size must be divisible by 2**(depth-1).
+    """
+    def __init__(self, depth=3, width=64, num_class=1):
+        super().__init__()
+        enc_chs          = (1,)+tuple(width*2**i for i in range(depth))
+        self.encoder     = Encoder(enc_chs, padding = 1)
+        self.decoder     = Decoder(enc_chs[:0:-1], padding = 1)
+        self.head        = nn.Conv2d(width, num_class, 1)
+
+    def forward(self, x):
+        x = torch.unsqueeze(x, dim = 1)
+        enc_ftrs = self.encoder(x)
+        out      = self.decoder(enc_ftrs[::-1][0], enc_ftrs[::-1][1:])
+        return self.head(out)
+
+
 if __name__ == "__main__":
     #testing model, take 1 graph as input print the shape of the prediction and plot the prediction.
     #Note, this test is on an untrained model so the plot only gives you an idea of the impact of the model-
@@ -0,0 +1,108 @@
+"""
+Compact on-disk format of the dataset. The binary 128x128 input masks are stored with np.packbits (one bit per
+pixel, 64x smaller than float64) and the targets as float16 (4x smaller), both as .npy files so they can be memory
+mapped, next to a meta.json with the shapes, dtypes and the largest rounding error of the targets:
+
+    packed_10k/masks.npy     uint8 (N, H*W/8)
+    packed_10k/targets.npy   float16 (N, H, W)
+    packed_10k/meta.json
+
+meta.json is written last and atomically and removed before the arrays of a rewrite are replaced, so a folder with
+a meta.json always holds the complete arrays it describes, an interrupted conversion leaves no meta.json.
+
+PackedData reads it batch by batch like MemmapData, the bits of a batch are unpacked in one vectorized
+np.unpackbits call. Use it through load_data(..., packed = True).
+
+Usage: python Packed.py ../Data    converts input_images_10k.npy and target_images_10k.npy to ../Data/packed_10k
+"""
+import argparse
+import json
+import os
+import numpy as np
+from Dataloader import MemmapData, data_paths
+
+
+def packed_dir(input_path):
+    """ Folder of the packed copy of the dataset with the inputs input_path, e.g. Data/packed_10k """
+    name = os.path.splitext(os.path.basename(input_path))[0].replace('input_images', 'packed')
+    return os.path.join(os.path.dirname(input_path), name)
+
+
+def write_packed(input_path, target_path, out_dir = None, target_dtype = 'float16', chunk = 1024):
+    """ Converts the .npy inputs and targets to the packed format in out_dir (default packed_dir(input_path)),
+    chunk samples at a time through memory maps. Raises ValueError for inputs that are not binary. """
+    out_dir = out_dir or packed_dir(input_path)
+    os.makedirs(out_dir, exist_ok = True)
+    masks = np.load(input_path, mmap_mode = 'r')
+    targets = np.load(target_path, mmap_mode = 'r')
+    n, H, W = masks.shape
+    bits = np.lib.format.open_memmap(os.path.join(out_dir, "masks.npy.tmp"), mode = 'w+', dtype = np.uint8,
+                                     shape = (n, -(-H*W//8)))
+    compact = np.lib.format.open_memmap(os.path.join(out_dir, "targets.npy.tmp"), mode = 'w+',
+                                        dtype = target_dtype, shape = targets.shape)
+    error = 0.0
+    for start in range(0, n, chunk):
+        x = np.asarray(masks[start:start+chunk])
+        if not np.isin(x, (0, 1)).all():
+            raise ValueError("{} holds values other than 0 and 1, it cannot be bit packed".format(input_path))
+        bits[start:start+chunk] = np.packbits(x.reshape(len(x), H*W).astype(bool), axis = 1)
+        y = np.asarray(targets[start:start+chunk])
+        compact[start:start+chunk] = y
+        error = max(error, float(np.abs(compact[start:start+chunk].astype(np.float64)-y).max()))
+    bits.flush()
+    compact.flush()
+    del bits, compact
+    meta = {
+        'num_samples': n,
+        'shape': [H, W],
+        'input_dtype': str(masks.dtype),
+        'target_dtype': str(targets.dtype),
+        'packed_target_dtype': str(np.dtype(target_dtype)),
+        'target_max_abs_error': error,
+        'bit_order': 'big',
+    }
+    meta_path = os.path.join(out_dir, "meta.json")
+    if os.path.exists(meta_path): #the old arrays are about to be replaced
+        os.remove(meta_path)
+    for name in ("masks.npy", "targets.npy"):
+        os.replace(os.path.join(out_dir, name+".tmp"), os.path.join(out_dir, name))
+    with open(meta_path+".tmp", "w") as f:
+        json.dump(meta, f, indent = 1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(meta_path+".tmp", meta_path)
+    return out_dir
+
+
+def read_meta(directory):
+    """ Metadata of a packed dataset, raises FileNotFoundError if the conversion did not finish """
+    path = os.path.join(directory, "meta.json")
+    if not os.path.exists(path):
+        raise FileNotFoundError("{} has no meta.json, the conversion did not finish, run Packed.py again".format(
+                                directory))
+    with open(path) as f:
+        return json.load(f)
+
+
+class PackedData(MemmapData):
+    """ MemmapData over a packed_dir, same batch indexing. With mmap = False the packed arrays of the split are
+    read into memory, which is small: about 2.1 kB per mask and 32 kB per float16 target. """
+    def __init__(self, directory, indices, device, rotate = False, mmap = True):
+        self.shape = tuple(read_meta(directory)['shape'])
+        super().__init__(os.path.join(directory, "masks.npy"), os.path.join(directory, "targets.npy"), indices,
+                         device, rotate, mmap)
+
+    def read(self, rows):
+        H, W = self.shape
+        x = np.unpackbits(self.x[rows], axis = 1, count = H*W).reshape(len(rows), H, W).astype(np.float32)
+        return x, self.y[rows].astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Convert the dataset to bit packed masks and float16 targets")
+    parser.add_argument("path", help = "folder with input_images_10k.npy and target_images_10k.npy")
+    parser.add_argument("--target_dtype", default = "float16")
+    args = parser.parse_args()
+
+    out_dir = write_packed(*data_paths('cpu', args.path), target_dtype = args.target_dtype)
+    print(out_dir, read_meta(out_dir))
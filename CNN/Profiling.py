@@ -0,0 +1,169 @@
+""" Opt-in instrumentation of the training loop (Trainer.train(instrument = True, profile = ...)).
+
+PhaseTimer records the wall time of the phases of every step (data, forward, backward, optimizer, eval and
+checkpoint) and on cuda also their device time with cuda events, which are only read when the epoch summary is
+built, so no extra host sync happens inside the epoch. Wall times of cuda phases measure the host side (kernel
+launches) unless the phase waits for the device, the device times are the time between the events on the stream.
+summary() also holds the samples per second and the peak memory of the epoch (torch.cuda.max_memory_allocated,
+on cpu the peak resident set of the process). Summaries are appended as one JSON line per epoch to
+train_log_<device>.jsonl next to losses_<device>.pt (append_jsonl).
+
+Disabled timers hand out one shared no-op context and return the loader itself from iterate, so the loop pays one
+attribute lookup and call per phase.
+
+Profiler(path, first_step, num_steps) runs torch.profiler for num_steps training steps starting at the global step
+first_step (one warm up step before), with the phases as named ranges, and exports a Chrome trace to path
+(open in chrome://tracing or https://ui.perfetto.dev).
+"""
+import contextlib
+import json
+import os
+import time
+import torch
+
+
+def peak_rss(reset = False):
+    """ Peak resident set size of this process in bytes (VmHWM, Linux), reset = True restarts it from the current
+    resident set. None where /proc is not available. """
+    try:
+        if reset:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1])*1024 for line in f if line.startswith("VmHWM"))
+    except (OSError, StopIteration):
+        return None
+
+
+def append_jsonl(record, path):
+    with open(path, "a") as f:
+        f.write(json.dumps(record)+"\n")
+
+
+class PhaseTimer:
+    def __init__(self, device, enabled = True):
+        self.device = torch.device(device)
+        self.enabled = enabled
+        self.cuda = enabled and self.device.type == 'cuda'
+        self.profiling = False
+        self.noop = contextlib.nullcontext()
+        self.reset()
+
+    def reset(self):
+        self.wall = {}
+        self.count = {}
+        self.events = {} #phase: [(start, end)] cuda events, read in summary()
+        self.samples = 0
+        self.steps = 0
+        self.start = time.perf_counter()
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        elif self.enabled:
+            peak_rss(reset = True)
+
+    def phase(self, name):
+        if not self.enabled:
+            return self.noop
+        return self._phase(name)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        record = torch.profiler.record_function(name) if self.profiling else self.noop
+        if self.cuda:
+            start, end = torch.cuda.Event(enable_timing = True), torch.cuda.Event(enable_timing = True)
+            start.record()
+        t_0 = time.perf_counter()
+        with record:
+            yield
+        self.wall[name] = self.wall.get(name, 0.0)+time.perf_counter()-t_0
+        self.count[name] = self.count.get(name, 0)+1
+        if self.cuda:
+            end.record()
+            self.events.setdefault(name, []).append((start, end))
+
+    def iterate(self, loader, name = 'data'):
+        """ The batches of loader, the time to fetch each one counts as phase name """
+        if not self.enabled:
+            return loader
+        return self._iterate(loader, name)
+
+    def _iterate(self, loader, name):
+        batches = iter(loader)
+        while True:
+            with self.phase(name):
+                batch = next(batches, None)
+            if batch is None:
+                return
+            yield batch
+
+    def step(self, samples):
+        if self.enabled:
+            self.steps += 1
+            self.samples += samples
+
+    def summary(self):
+        """ Totals since the last reset (per phase wall and device seconds and calls, samples per second, peak
+        memory) as a dict, then resets. None when disabled. """
+        if not self.enabled:
+            return None
+        elapsed = time.perf_counter()-self.start
+        phases = {name: {'wall': self.wall[name], 'calls': self.count[name]} for name in self.wall}
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+            for name, events in self.events.items():
+                phases[name]['device'] = sum(s.elapsed_time(e) for s, e in events)/1e3
+            peak = torch.cuda.max_memory_allocated(self.device)
+        else:
+            peak = peak_rss()
+        summary = {
+            'time': elapsed,
+            'steps': self.steps,
+            'samples': self.samples,
+            'samples_per_s': self.samples/elapsed if elapsed > 0 else None,
+            'peak_memory': peak,
+            'phases': phases,
+        }
+        self.reset()
+        return summary
+
+
+class Profiler:
+    """ torch.profiler over the global training steps [first_step, first_step+num_steps), call step() after every
+    training step. The trace is exported when the window closes. """
+    def __init__(self, path, first_step = 10, num_steps = 5, device = 'cpu', timer = None):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.device(device).type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.path = path
+        self.timer = timer
+        warmup = min(1, first_step)
+        self.profiler = torch.profiler.profile(
+            activities = activities,
+            schedule = torch.profiler.schedule(wait = first_step-warmup, warmup = warmup, active = num_steps, repeat = 1),
+            on_trace_ready = self.export,
+            record_shapes = True,
+            profile_memory = True)
+        self.active_steps = range(first_step-warmup, first_step+num_steps)
+        self.current = 0
+        self.profiler.start()
+        self._mark()
+
+    def _mark(self):
+        if self.timer is not None:
+            self.timer.profiling = self.current in self.active_steps
+
+    def export(self, profiler):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok = True)
+        profiler.export_chrome_trace(self.path)
+
+    def step(self):
+        self.profiler.step()
+        self.current += 1
+        self._mark()
+
+    def stop(self):
+        """ Ends the profiler, a window cut short by the end of training is exported as far as it got """
+        self.profiler.stop()
+        if self.timer is not None:
+            self.timer.profiling = False
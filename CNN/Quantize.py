@@ -0,0 +1,120 @@
+"""
+Post-training int8 quantization and structured pruning of a trained UNet for CPU-only nodes.
+
+prune_blocks removes the inner channels of every Block (the outputs of conv1 and inputs of conv2) with the
+smallest L1 norm, so the channels seen by the skip connections and the decoder are unchanged. Without fine-tuning
+(Trainer.train(..., model = pruned)) the error grows quickly with the pruned fraction.
+quantize is FX graph mode static quantization: observers are inserted, a slice of the dataset is run through the
+model for calibration and the model is converted to int8 kernels. The result is saved as a TorchScript module,
+load it with torch.jit.load (no model code needed) and use it with Inference.predict.
+
+Usage: python Quantize.py checkpoint_cpu.pt --data ../Data --prune 0.25 --output unet_int8.pt
+prints CPU latency, model size and the MSE against the targets and against the fp32 checkpoint. The samples come
+from the persisted train/test split of the data (Dataloader.load_split, as in training): calibration uses
+training samples, the MSEs are measured on held-out test samples.
+"""
+import argparse
+import copy
+import io
+import os
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from Model import Block, PaddedUNet
+from Inference import load_model, predict, _batches, export_torchscript
+from Dataloader import data_paths, load_split
+
+
+def prune_blocks(model, amount = 0.25):
+    """ Copy of model with round(amount*out_ch) inner channels removed from every Block """
+    model = copy.deepcopy(model)
+    for block in model.modules():
+        if not isinstance(block, Block):
+            continue
+        conv1, conv2 = block.conv1, block.conv2
+        num_keep = max(1, conv1.out_channels-int(round(amount*conv1.out_channels)))
+        keep = conv1.weight.detach().abs().sum(dim = (1, 2, 3)).argsort(descending = True)[:num_keep].sort().values
+        block.conv1 = nn.Conv2d(conv1.in_channels, num_keep, conv1.kernel_size, padding = conv1.padding)
+        block.conv2 = nn.Conv2d(num_keep, conv2.out_channels, conv2.kernel_size, padding = conv2.padding)
+        with torch.no_grad():
+            block.conv1.weight.copy_(conv1.weight[keep])
+            block.conv1.bias.copy_(conv1.bias[keep])
+            block.conv2.weight.copy_(conv2.weight[:, keep])
+            block.conv2.bias.copy_(conv2.bias)
+    return model
+
+
+def quantize(model, calibration_masks, batch_size = 32, backend = 'x86'):
+    """ int8 copy of model (on cpu), calibrated on calibration_masks (N, 128, 128) """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+    for conv in model.modules():
+        if isinstance(conv, nn.Conv2d) and conv.padding == 'same': #the int8 convolutions only take integers
+            conv.padding = tuple(d*(k-1)//2 for k, d in zip(conv.kernel_size, conv.dilation))
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), (torch.zeros(1, 128, 128),))
+    with torch.no_grad():
+        for batch in _batches(calibration_masks, batch_size):
+            prepared(torch.as_tensor(np.asarray(batch, dtype = np.float32)))
+    return convert_fx(prepared)
+
+
+def model_size(model):
+    """ Bytes of the serialized state dict """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def latency(model, batch_size, repeats = 5):
+    """ Best CPU forward time in ms for a batch of 128x128 inputs """
+    x = torch.rand(batch_size, 128, 128)
+    best = float("inf")
+    with torch.inference_mode():
+        model(x)
+        for _ in range(repeats):
+            t_0 = time.perf_counter()
+            model(x)
+            best = min(best, time.perf_counter()-t_0)
+    return 1e3*best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "int8 quantization and pruning of a trained UNet")
+    parser.add_argument("checkpoint")
+    parser.add_argument("--data", default = None, help = "folder with input_images_10k.npy and target_images_10k.npy")
+    parser.add_argument("--padded", action = "store_true", help = "checkpoint of a PaddedUNet()")
+    parser.add_argument("--prune", type = float, default = 0, help = "fraction of the Block channels to remove")
+    parser.add_argument("--calibration", type = int, default = 256, help = "training masks used for calibration")
+    parser.add_argument("--eval", type = int, default = 256, help = "test masks used for the MSE")
+    parser.add_argument("--split", type = float, default = 0.33, help = "test fraction of the split used in training")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the split used in training")
+    parser.add_argument("--backend", default = "x86", help = "x86 (fbgemm) or qnnpack for ARM")
+    parser.add_argument("--output", default = "unet_int8.pt")
+    args = parser.parse_args()
+
+    input_path, target_path = data_paths('cpu', args.data)
+    masks = np.load(input_path, mmap_mode = 'r')
+    targets = np.load(target_path, mmap_mode = 'r')
+    train_idx, test_idx = load_split(input_path, target_path, args.split, args.seed)
+    calibration = masks[train_idx[:args.calibration]]
+    eval_masks = np.asarray(masks[test_idx[:args.eval]], dtype = np.float32)
+    eval_targets = np.asarray(targets[test_idx[:args.eval]], dtype = np.float32)
+
+    fp32 = load_model(args.checkpoint, 'cpu', PaddedUNet() if args.padded else None)
+    models = {"fp32": fp32}
+    if args.prune > 0:
+        models["pruned fp32"] = prune_blocks(fp32, args.prune)
+    models["int8"] = quantize(models["pruned fp32"] if args.prune > 0 else fp32, calibration, backend = args.backend)
+    export_torchscript(models["int8"], args.output)
+
+    reference = predict(fp32, eval_masks, 32)
+    print("{:>12} {:>10} {:>12} {:>12} {:>14} {:>14}".format("model", "size [MB]", "bs=1 [ms]", "bs=16 [ms]",
+                                                            "MSE target", "MSE vs fp32"))
+    for name, model in models.items():
+        pred = predict(model, eval_masks, 32)
+        print("{:>12} {:>10.2f} {:>12.1f} {:>12.1f} {:>14.4g} {:>14.4g}".format(name, model_size(model)/2**20,
+              latency(model, 1), latency(model, 16), np.mean((pred-eval_targets)**2), np.mean((pred-reference)**2)))
+    print("saved {} ({:.2f} MB)".format(args.output, os.path.getsize(args.output)/2**20))
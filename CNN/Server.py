@@ -0,0 +1,172 @@
+"""
+Local prediction server with dynamic micro-batching. Concurrent requests are queued and a single worker thread
+runs them through one model instance in batches of at most max_batch_size, waiting at most max_wait_ms for a
+batch to fill up after the first request arrived.
+
+HTTP on localhost or a Unix socket:
+    POST /predict   body: one 128x128 mask as raw float32 (or uint8) bytes, row major
+                    response: the 128x128 prediction as raw float32 bytes
+    GET  /metrics   JSON with request count, p50/p99 latency in ms, current queue depth and mean batch size
+
+Usage: python Server.py checkpoint_cuda-0.pt --port 8080
+       python Server.py checkpoint_cuda-0.pt --socket /tmp/unet.sock
+"""
+import argparse
+import collections
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import torch
+from Model import PaddedUNet
+from Inference import load_model
+
+
+class MicroBatcher:
+    """ Collects single mask requests into batches for one model, see the module docstring """
+    def __init__(self, model, device = 'cpu', max_batch_size = 32, max_wait_ms = 2, shape = (128, 128)):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms/1e3
+        self.shape = shape
+        self.queue = queue.Queue()
+        self.latencies = collections.deque(maxlen = 10000) #seconds, most recent requests
+        self.batch_sizes = collections.deque(maxlen = 10000)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def submit(self, mask):
+        """ Future holding the (H, W) float32 prediction of one mask """
+        future = Future()
+        self.queue.put((np.asarray(mask, dtype = np.float32).reshape(self.shape), future, time.perf_counter()))
+        return future
+
+    def predict(self, mask):
+        return self.submit(mask).result()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter()+self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline-time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout = timeout))
+                except queue.Empty:
+                    break
+            masks, futures, t_0 = zip(*batch)
+            try:
+                with torch.inference_mode():
+                    x = torch.from_numpy(np.stack(masks)).to(self.device)
+                    pred = self.model(x)[:, 0].float().cpu().numpy()
+            except Exception as e:
+                for f in futures:
+                    f.set_exception(e)
+                continue
+            t_1 = time.perf_counter()
+            for f, p in zip(futures, pred):
+                f.set_result(p)
+            with self.lock:
+                self.latencies.extend(t_1-t for t in t_0)
+                self.batch_sizes.append(len(batch))
+
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = np.array(self.batch_sizes)
+        return {
+            'requests': int(batch_sizes.sum()),
+            'p50_ms': float(np.percentile(latencies, 50)*1e3) if len(latencies) else None,
+            'p99_ms': float(np.percentile(latencies, 99)*1e3) if len(latencies) else None,
+            'queue_depth': self.queue.qsize(),
+            'mean_batch_size': float(batch_sizes.mean()) if len(batch_sizes) else None,
+        }
+
+    def reset_metrics(self):
+        with self.lock:
+            self.latencies.clear()
+            self.batch_sizes.clear()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' #keep-alive, every reply has a Content-Length
+    batcher = None #set by make_server
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self.send_error(404)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        n = self.batcher.shape[0]*self.batcher.shape[1]
+        if len(body) == 4*n:
+            mask = np.frombuffer(body, dtype = np.float32)
+        elif len(body) == n:
+            mask = np.frombuffer(body, dtype = np.uint8)
+        else:
+            return self.send_error(400, "expected {} float32 or uint8 values".format(n))
+        self._reply(self.batcher.predict(mask).tobytes(), 'application/octet-stream')
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            return self.send_error(404)
+        self._reply(json.dumps(self.batcher.metrics()).encode(), 'application/json')
+
+    def _reply(self, data, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        pass #one line per request would dominate the cost
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class TCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 #the default of 5 drops connections under load, clients retry after a second
+
+
+def make_server(batcher, port = 8080, socket_path = None):
+    """ HTTP server for the batcher on localhost:port, or on a Unix socket if socket_path is given """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, type('BoundHandler', (Handler,), {'batcher': batcher}))
+    #headers and body are written separately, without TCP_NODELAY Nagle's algorithm delays keep-alive replies
+    handler = type('BoundHandler', (Handler,), {'batcher': batcher, 'disable_nagle_algorithm': True})
+    return TCPHTTPServer(('127.0.0.1', port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve UNet predictions with dynamic micro-batching")
+    parser.add_argument("checkpoint")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--socket", default = None, help = "serve on this Unix socket instead of a port")
+    parser.add_argument("--device", default = "cpu")
+    parser.add_argument("--padded", action = "store_true", help = "checkpoint of a PaddedUNet()")
+    parser.add_argument("--max_batch_size", type = int, default = 32)
+    parser.add_argument("--max_wait_ms", type = float, default = 2)
+    args = parser.parse_args()
+
+    model = load_model(args.checkpoint, args.device, PaddedUNet() if args.padded else None)
+    batcher = MicroBatcher(model, args.device, args.max_batch_size, args.max_wait_ms)
+    server = make_server(batcher, args.port, args.socket)
+    print("serving on {}".format(args.socket or "http://127.0.0.1:{}".format(args.port)))
+    server.serve_forever()
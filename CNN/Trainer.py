@@ -1,71 +1,192 @@
 import torch
 import torch.nn as nn
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 import numpy as np
 from Dataloader import load_data
 from Model import UNet
+from Metrics import RunningMean, AsyncWriter, snapshot
+from Checkpoint import CheckpointManager, rng_state, set_rng_state
+from Losses import make_loss
+from Profiling import PhaseTimer, Profiler, append_jsonl
 import matplotlib.pyplot as plt
 
 
-def train(device, num_epochs, checkpoint, testloader, trainloader):
+def train(device, num_epochs, checkpoint, testloader, trainloader, amp = False, channels_last = False,
+          log_every = None, model = None, keep_last = 3, objective = 'mse', instrument = False, profile = None):
+    """ amp = True runs forward passes under autocast, float16 with a GradScaler on cuda and bfloat16 on cpu.
+    channels_last = True uses the channels_last memory format for the UNet weights and activations.
+    Losses are always computed in float32.
+    Batch losses are accumulated on the device and read once per epoch, log_every = N also prints the running
+    train loss every N steps (one host sync each time). Losses and checkpoints are written on a background thread.
+    Every epoch is checkpointed with the full training state, the last keep_last epochs and the best one are kept
+    (see Checkpoint.py). checkpoint = True resumes from the newest checkpoint at the epoch after it, num_epochs
+    counts from the start of the first run. Build the loaders with the checkpoint's 'split' (resume_split).
+    Otherwise the checkpoints of an earlier run on the same device are removed first.
+    model defaults to UNet(), e.g. PaddedUNet() trains the shape preserving variant.
+    objective is the training loss, 'mse', 'sinkhorn', 'mse+sinkhorn' (see Losses.make_loss) or a loss module
+    such as Losses.SinkhornLoss(blur = 0.01). The test loss stays the MSE so runs with different objectives compare.
+    instrument = True times the phases of every step (data, forward, backward, optimizer, eval, checkpoint) and
+    appends a summary per epoch (phase wall and device times, samples/s, peak memory) with the losses to
+    train_log_<device>.jsonl, see Profiling.py. profile = (first_step, num_steps) also runs torch.profiler over
+    these global steps and writes the Chrome trace trace_<device>.json (rank 0), it implies instrument = True.
+    Inside an initialised torch.distributed process group (see Distributed.py) the model is wrapped in
+    DistributedDataParallel, the losses are averaged over all ranks and only rank 0 prints and writes files. The
+    test loss is the mean over the test samples, with an unpadded test sharding (load_data_distributed) it equals
+    the single process value.
+    """
 
     num_epochs = num_epochs
-    model = UNet()
+    if model is None:
+        model = UNet()
 
     #use this when training on the cluster
     device= torch.device(device)
+    distributed = dist.is_available() and dist.is_initialized()
+    rank = dist.get_rank() if distributed else 0
+    name = 'cuda:0' if distributed and device.type == 'cuda' else device #rank 0 names the files, all ranks resume
     model = model.to(device)
+    if channels_last:
+        model = model.to(memory_format = torch.channels_last)
     optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
 
+    amp_dtype = torch.bfloat16 if device.type == 'cpu' else torch.float16
+    scaler = torch.amp.GradScaler(device.type, enabled = amp and amp_dtype == torch.float16)
+
+    writer = AsyncWriter()
+    manager = CheckpointManager("checkpoint_{}".format(name), keep_last = keep_last, writer = writer)
+    TrainLoss = []
+    TestLoss = []
+    start_epoch = 0
+    best_epoch = None
     if checkpoint == True:
-        checkpoint = torch.load("checkpoint_{}.pt".format(device), map_location = torch.device(device))
+        checkpoint = manager.load(map_location = device)
+        if checkpoint is None:
+            raise FileNotFoundError("no checkpoint_{}*.pt to resume from".format(name))
         model.load_state_dict(checkpoint['model_state_dict'])
         optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        if 'scaler_state_dict' in checkpoint:
+            scaler.load_state_dict(checkpoint['scaler_state_dict'])
+        if 'epoch' in checkpoint: #older checkpoints only hold the weights
+            start_epoch = checkpoint['epoch']+1
+            TrainLoss = list(checkpoint['TrainLoss'])
+            TestLoss = list(checkpoint['TestLoss'])
+            best_epoch = checkpoint['best_epoch']
+            set_rng_state(checkpoint['rng_state'])
+        del checkpoint
+    elif rank == 0:
+        manager.clear() #epochs of an earlier run would otherwise be resumed or linger past keep_last
+
+    module = model #unwrapped, for the checkpoints
+    if distributed:
+        model = DistributedDataParallel(model, device_ids = [device] if device.type == 'cuda' else None)
 
     loss_fn = nn.MSELoss()
-
-    TrainLoss = []
-    TestLoss = []
-    for epoch in range(num_epochs):
+    objective_fn = objective if isinstance(objective, nn.Module) else make_loss(objective)
+
+    train_loss = RunningMean(device, distributed)
+    test_loss = RunningMean(device, distributed)
+    timer = PhaseTimer(device, enabled = instrument or profile is not None)
+    profiler = None
+    if profile and rank == 0:
+        profiler = Profiler("trace_{}.json".format(name), *profile, device = device, timer = timer)
+    written = writer.busy
+    for epoch in range(start_epoch, num_epochs):
+        set_epoch(trainloader, epoch)
         model.train()
-        train_batch_losses = []
-        for i, (x, y) in enumerate(trainloader):
+        train_loss.reset()
+        timer.reset()
+        for i, (x, y) in enumerate(timer.iterate(trainloader)):
             # zero the parameter gradients
             optimizer.zero_grad()
             # forward + backward + optimize
-            output = model(x).to(device)
-            loss = loss_fn(output, y.unsqueeze(1))
-            train_batch_losses.append(loss.item())
-            loss.backward()
-            optimizer.step()
-
-        with torch.no_grad():
+            with timer.phase('forward'):
+                with torch.autocast(device.type, dtype = amp_dtype, enabled = amp):
+                    output = model(x).to(device)
+                loss = objective_fn(output.float(), y.unsqueeze(1))
+                train_loss.update(loss)
+            with timer.phase('backward'):
+                scaler.scale(loss).backward()
+            with timer.phase('optimizer'):
+                scaler.step(optimizer)
+                scaler.update()
+            timer.step(len(x))
+            if profiler is not None:
+                profiler.step()
+            if log_every and (i+1) % log_every == 0:
+                loss_value = train_loss.compute()
+                if rank == 0:
+                    print("trainloss: {} | at step {} of epoch {}".format(loss_value, i+1, epoch))
+
+        with torch.no_grad(), timer.phase('eval'):
             model.eval()
-            test_batch_losses = []
+            test_loss.reset()
             for i, (x_test, y_test) in enumerate(testloader):
-                output = model(x_test).to(device)
-                test_loss = loss_fn(output.squeeze(1), y_test)
-                test_batch_losses.append(test_loss.item())
-
-            TestLoss.append(np.mean(test_batch_losses))
-
+                with torch.autocast(device.type, dtype = amp_dtype, enabled = amp):
+                    output = module(x_test).to(device) #no DDP collectives, ranks may hold different batch counts
+                test_loss.update(loss_fn(output.float().squeeze(1), y_test), len(x_test)) #mean over samples
 
-        TrainLoss.append(np.mean(train_batch_losses))
-        print("testloss: {} | trainloss: {} | at epoch {}/{}".format(TestLoss[-1], TrainLoss[-1], epoch, num_epochs))
+            TestLoss.append(test_loss.compute())
 
-        torch.save({
-                'TrainLoss': TrainLoss,
-                'TestLoss':TestLoss
-                }, 'losses_{}.pt'.format(device))
 
-        if epoch == 0:
+        TrainLoss.append(train_loss.compute())
+        if rank != 0:
             continue
-
-        if TestLoss[-1] < np.min(TestLoss[0:-1]):
-            torch.save({
-                    'best_epoch': epoch,
-                    'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict(),
-                    }, 'checkpoint_{}.pt'.format(device))
+        print("testloss: {} | trainloss: {} | at epoch {}/{}".format(TestLoss[-1], TrainLoss[-1], epoch, num_epochs))
+
+        with timer.phase('checkpoint'): #the files are written by the background thread, this is the snapshot cost
+            writer.save({
+                    'TrainLoss': list(TrainLoss),
+                    'TestLoss': list(TestLoss)
+                    }, 'losses_{}.pt'.format(name))
+
+            best = best_epoch is None or TestLoss[-1] < TestLoss[best_epoch]
+            if best:
+                best_epoch = epoch
+            manager.save({
+                    'epoch': epoch,
+                    'best_epoch': best_epoch,
+                    'model_state_dict': snapshot(module.state_dict()),
+                    'optimizer_state_dict': snapshot(optimizer.state_dict()),
+                    'scaler_state_dict': scaler.state_dict(),
+                    'TrainLoss': list(TrainLoss),
+                    'TestLoss': list(TestLoss),
+                    'rng_state': rng_state(),
+                    'split': split_indices(trainloader, testloader),
+                    }, epoch, best)
+
+        summary = timer.summary()
+        if summary is not None:
+            summary.update(epoch = epoch, train_loss = TrainLoss[-1], test_loss = TestLoss[-1],
+                           background_write = writer.busy-written) #previous epoch's files, off the training thread
+            written = writer.busy
+            writer.submit(append_jsonl, summary, "train_log_{}.jsonl".format(name))
+
+    if profiler is not None:
+        profiler.stop()
+    writer.close()
+
+
+def split_indices(trainloader, testloader):
+    """ (train_idx, test_idx) of the datasets behind the loaders as int64 tensors, None if they do not record them """
+    indices = [getattr(getattr(loader, 'dataset', None), 'indices', None) for loader in (trainloader, testloader)]
+    if any(i is None for i in indices):
+        return None
+    return tuple(torch.from_numpy(np.asarray(i, dtype = np.int64)) for i in indices)
+
+
+def resume_split(device):
+    """ Split indices of the newest checkpoint for load_data(..., indices = ...), None without a checkpoint """
+    state = CheckpointManager("checkpoint_{}".format(torch.device(device))).load()
+    return None if state is None else state.get('split')
+
+
+def set_epoch(loader, epoch):
+    """ Reshuffles a DistributedSampler (also when wrapped in a BatchSampler) for the next epoch """
+    sampler = getattr(loader, 'sampler', None)
+    sampler = getattr(sampler, 'sampler', sampler)
+    if hasattr(sampler, 'set_epoch'):
+        sampler.set_epoch(epoch)
 
 
 if __name__ == "__main__":
@@ -73,6 +194,14 @@ if __name__ == "__main__":
     num_epochs = 100
     use_checkpoint = False
     batch_size = 10
-
-    trainloader, testloader, train_data, test_data = load_data(split = 0.33, batch_size = batch_size, device = device)
-    train(device, num_epochs, use_checkpoint, testloader, trainloader)
+    amp = False
+    channels_last = False
+    objective = 'mse' #or 'sinkhorn', 'mse+sinkhorn'
+    instrument = False #per phase timings in train_log_<device>.jsonl
+    profile = None #(first_step, num_steps) for a torch.profiler trace
+
+    indices = resume_split(device) if use_checkpoint else None
+    trainloader, testloader, train_data, test_data = load_data(split = 0.33, batch_size = batch_size, device = device,
+                                                               indices = indices)
+    train(device, num_epochs, use_checkpoint, testloader, trainloader, amp = amp, channels_last = channels_last,
+          objective = objective, instrument = instrument, profile = profile)
@@ -4,85 +4,106 @@ import torch
 import torch.nn as nn
 import matplotlib.pyplot as plt
 import numpy as np
-from random import choices
-from geomloss import SamplesLoss
 import time
 
-def draw_samples(x, n, dtype=torch.FloatTensor):
-    A = x
-    xg, yg = np.meshgrid(
-        np.linspace(0, 1, A.shape[0]),
-        np.linspace(0, 1, A.shape[1]),
-        indexing="xy",
-    )
 
-    grid = list(zip(xg.ravel(), yg.ravel()))
+def _grid(shape):
+    """ x and y coordinates of the flat pixel indices of an image of shape, in the order draw_samples always used
+    (x runs over the first axis, y over the second, both over [0, 1]) """
+    xs = np.linspace(0, 1, shape[0])
+    ys = np.linspace(0, 1, shape[1])
+    k = np.arange(shape[0]*shape[1])
+    return np.stack([xs[k % shape[0]], ys[k // shape[0]]], axis = 1)
+
+
+def draw_samples(x, n, dtype=torch.FloatTensor, rng=None):
+    """ n points drawn with the density of the image x (H, W) plus Gaussian noise of half a pixel, as (n, 2).
+    rng is a np.random.Generator (default a fresh one), so the draws can be seeded with the rest of NumPy. """
+    A = np.asarray(x)
+    rng = np.random.default_rng() if rng is None else rng
     dens = A.ravel() / A.sum()
-    dots = np.array(choices(grid, dens, k=n))
-    dots += (0.5 / A.shape[0]) * np.random.standard_normal(dots.shape)
+    dots = _grid(A.shape)[rng.choice(A.size, size=n, p=dens)]
+    dots += (0.5 / A.shape[0]) * rng.standard_normal(dots.shape)
 
     return torch.from_numpy(dots).type(dtype)
 
-path = "/Users/martinkristiansen/Desktop/Simula_2022/Data/"
-input = np.load(path+"input_images.npy")
-target = np.load(path+"target_images.npy")
-
-x = draw_samples(input[0], 100)
-
-model = UNet()
-
-loss_fn = SamplesLoss("sinkhorn", blur=0.01, scaling=0.9)
-# x = model(x.unsqueeze(0))
-# x = x[0, 0, :, :].detach()
-x = x.clone().detach().requires_grad_(True)
-
-def PointsInCircum(r,n=100):
-    return [(0.4+np.cos(2*np.pi/n*x)*r,0.4+np.sin(2*np.pi/n*x)*r) for x in range(0,n+1)]
-
-y = PointsInCircum(0.3, n=100)
-y = torch.from_numpy(np.array(y)).type(torch.FloatTensor)
-
-def display_samples(ax, x):
-    x_ = x.detach().cpu().numpy()
-    ax.scatter(x_[:, 0], x_[:, 1], s = 5)#, edgecolors="none")
-
-
-# Euler Scheme
-lr = 0.1
-Nsteps = int(5 / lr) + 1
-display_its = [int(t / lr) for t in [0, 0.25, 0.50, 1.0, 2.0, 5.0]]
-
-t_0 = time.time()
-plt.figure(figsize=(12, 8))
-k = 1
-for i in range(Nsteps):
-    if i == 0:
-        lr = 0
-    else:
-        lr = 0.1
-    L = loss_fn(x, y)
-    [g] = torch.autograd.grad(L, x)
-    x.data -= lr *len(x)* g
-    if i in display_its:  # display
-        ax = plt.subplot(2, 3, k)
-        k = k + 1
-        plt.set_cmap("hsv")
-        plt.scatter(
-            [10], [10]
-        )  # shameless hack to prevent a slight change of axis...
-
-        display_samples(ax, y)
-        display_samples(ax, x)
-
-        ax.set_title("t = {:1.2f}".format(lr * i))
-
-        plt.axis([0, 1, 0, 1])
-        plt.gca().set_aspect("equal", adjustable="box")
-        plt.xticks([], [])
-        plt.yticks([], [])
-        plt.tight_layout()
-
-plt.show()
+
+def draw_samples_batch(images, n, generator=None):
+    """ Batched draw_samples for a tensor of images (B, H, W): (B, n, 2) points on the device of images, drawn
+    with torch.multinomial in one call. generator is an optional torch.Generator on that device. """
+    B, H, W = images.shape
+    grid = torch.as_tensor(_grid((H, W)), dtype = images.dtype, device = images.device)
+    weights = images.reshape(B, H*W).clamp(min = 0)
+    index = torch.multinomial(weights, n, replacement = True, generator = generator)
+    dots = grid[index]
+    noise = torch.randn(dots.shape, generator = generator, dtype = dots.dtype, device = dots.device)
+    return dots + (0.5 / H) * noise
+
+
+if __name__ == "__main__":
+    from geomloss import SamplesLoss
+
+    path = "/Users/martinkristiansen/Desktop/Simula_2022/Data/"
+    input = np.load(path+"input_images.npy")
+    target = np.load(path+"target_images.npy")
+
+    x = draw_samples(input[0], 100)
+
+    model = UNet()
+
+    loss_fn = SamplesLoss("sinkhorn", blur=0.01, scaling=0.9)
+    # x = model(x.unsqueeze(0))
+    # x = x[0, 0, :, :].detach()
+    x = x.clone().detach().requires_grad_(True)
+
+    def PointsInCircum(r,n=100):
+        return [(0.4+np.cos(2*np.pi/n*x)*r,0.4+np.sin(2*np.pi/n*x)*r) for x in range(0,n+1)]
+
+    y = PointsInCircum(0.3, n=100)
+    y = torch.from_numpy(np.array(y)).type(torch.FloatTensor)
+
+    def display_samples(ax, x):
+        x_ = x.detach().cpu().numpy()
+        ax.scatter(x_[:, 0], x_[:, 1], s = 5)#, edgecolors="none")
+
+
+    # Euler Scheme
+    lr = 0.1
+    Nsteps = int(5 / lr) + 1
+    display_its = [int(t / lr) for t in [0, 0.25, 0.50, 1.0, 2.0, 5.0]]
+
+    t_0 = time.time()
+    plt.figure(figsize=(12, 8))
+    k = 1
+    for i in range(Nsteps):
+        if i == 0:
+            lr = 0
+        else:
+            lr = 0.1
+        L = loss_fn(x, y)
+        [g] = torch.autograd.grad(L, x)
+        x.data -= lr *len(x)* g
+        if i in display_its:  # display
+            ax = plt.subplot(2, 3, k)
+            k = k + 1
+            plt.set_cmap("hsv")
+            plt.scatter(
+                [10], [10]
+            )  # shameless hack to prevent a slight change of axis...
+
+            display_samples(ax, y)
+            display_samples(ax, x)
+
+            ax.set_title("t = {:1.2f}".format(lr * i))
+
+            plt.axis([0, 1, 0, 1])
+            plt.gca().set_aspect("equal", adjustable="box")
+            plt.xticks([], [])
+            plt.yticks([], [])
+            plt.tight_layout()
+
+    plt.show()
+
 
 
 
@@ -1,51 +1,94 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
+from scipy.spatial import cKDTree
 
 def intersect(p1, p2, p3, p4):
     """
     return True if lines intersect
     """
+    return bool(_intersect(np.array([p1, p2], dtype = float), np.array([p3, p4], dtype = float)))
 
-    x1, y1 = p1 # a point on the first line
-    x2, y2 = p2 # another point on the first line
-    x3, y3 = p3 # a point on the second line
-    x4, y4 = p4 # another point on the second line
 
-    #check paralell:
-    if (x1-x2)*(y3-y4) == (y1-y2)*(x3-x4):
-        return False
+def segments_intersect(s1, s2 = None, touching = True):
+    """ Vectorized intersection test between two sets of segments with shape (M, 2, 2) and (K, 2, 2), i.e.
+    [segment, endpoint, (x, y)]. Returns an (M, K) boolean matrix, s2 = None tests s1 against itself.
+    Parallel segments intersect only if they are collinear and overlap. touching = False ignores segments that
+    only touch, e.g. at a shared endpoint, but still counts collinear overlaps of positive length.
+    """
+    s1 = np.asarray(s1, dtype = float)
+    s2 = s1 if s2 is None else np.asarray(s2, dtype = float)
+    return _intersect(s1[:, None], s2[None, :], touching)
+
+
+def intersecting_pairs(segments, touching = True):
+    """ All pairs (i, j), i < j, of intersecting segments in a (M, 2, 2) array, sorted lexicographically.
+    Only pairs passing the midpoint broad phase are tested so the cost follows the number of close pairs
+    rather than M^2.
+    """
+    segments = np.asarray(segments, dtype = float)
+    pairs = _candidate_pairs(segments)
+    hit = _intersect(segments[pairs[:, 0]], segments[pairs[:, 1]], touching)
+    return pairs[hit]
 
-    px = ((x1*y2-y1*x2)*(x3-x4)-(x1-x2)*(x3*y4-y3*x4))/((x1-x2)*(y3-y4)-(y1-y2)*(x3-x4))
-    py = ((x1*y2-y1*x2)*(y3-y4)-(y1-y2)*(x3*y4-y3*x4))/((x1-x2)*(y3-y4)-(y1-y2)*(x3-x4))
 
-    #scalar value desciding point of intersection on line 1
-    t = ((x1-x3)*(y3-y4)-(y1-y3)*(x3-x4))/((x1-x2)*(y3-y4)-(y1-y2)*(x3-x4)) #scalar value desciding point of intersection on line 1
+def _intersect(a, b, touching = True):
+    """ Elementwise intersection test of broadcastable segment arrays (..., 2, 2) using orientation signs. """
+    p1, p2 = a[..., 0, :], a[..., 1, :]
+    p3, p4 = b[..., 0, :], b[..., 1, :]
+    d1 = _orientation(p3, p4, p1)
+    d2 = _orientation(p3, p4, p2)
+    d3 = _orientation(p1, p2, p3)
+    d4 = _orientation(p1, p2, p4)
 
-    #scalar value desciding point of intersection on line 2
-    u = ((x1-x3)*(y1-y2)-(y1-y3)*(x1-x2))/((x1-x2)*(y3-y4)-(y1-y2)*(x3-x4))
+    #endpoints strictly on opposite sides of the other line for both segments
+    crossing = (np.sign(d1)*np.sign(d2) < 0) & (np.sign(d3)*np.sign(d4) < 0)
+    if touching:
+        #an endpoint on the other segment, this also covers collinear overlaps
+        return crossing | ((d1 == 0) & _in_box(p3, p4, p1)) | ((d2 == 0) & _in_box(p3, p4, p2)) \
+                        | ((d3 == 0) & _in_box(p1, p2, p3)) | ((d4 == 0) & _in_box(p1, p2, p4))
 
-    _ = [t, u]
+    #collinear segments with a common piece of positive length
+    u = p2-p1
+    s3 = np.sum((p3-p1)*u, -1)
+    s4 = np.sum((p4-p1)*u, -1)
+    overlap = np.minimum(np.sum(u*u, -1), np.maximum(s3, s4)) - np.maximum(0, np.minimum(s3, s4))
+    collinear = (d1 == 0) & (d2 == 0) & (d3 == 0) & (d4 == 0)
+    return crossing | (collinear & (overlap > 0))
 
-    if all(0<= i <= 1 for i in _):
-        #print('points = {}'.format(((x1, y1),(x2, y2), (x3, y3), (x4, y4))))
-        print(px,py)
-        return True
 
-    return False
+def _orientation(p, q, r):
+    """ z-component of (q-p)x(r-p), positive if p, q, r are counter clockwise """
+    return (q[..., 0]-p[..., 0])*(r[..., 1]-p[..., 1]) - (q[..., 1]-p[..., 1])*(r[..., 0]-p[..., 0])
 
 
-def RRT(num_points, connectivity, starting_point, seed):
+def _in_box(p, q, r):
+    """ True if r lies in the bounding box of the segment p-q """
+    return np.all((np.minimum(p, q) <= r) & (r <= np.maximum(p, q)), -1)
+
+
+def RRT(num_points, connectivity, starting_point, seed, fast = False):
     """ Generates random points using the a version of the Rapid Random Trees algorithmself.
     low connectivity means high spread and vice versa.
+    fast = True uses incrementally built KD-trees for the nearest node lookups instead of scanning all nodes,
+    the generated points are identical for a given seed.
+    seed is either an int, seeding the global numpy RNG as before, or a np.random.Generator.
     """
-    np.random.seed(seed)
+    if isinstance(seed, np.random.Generator):
+        uniform = seed.uniform
+    else:
+        np.random.seed(seed)
+        uniform = np.random.uniform
     N = num_points
+    if fast:
+        samples = (connectivity*num_points)*uniform(low = 0, high = 1, size = (N-1, 2))
+        return _RRT_fast(samples, starting_point)
+
     a = np.multiply(np.ones((N, 2)), starting_point)
     points = np.zeros((N, 2))
     points[0] = starting_point
     for i in range(1, N):
-        b = (connectivity*num_points)*np.random.uniform(low = 0, high = 1, size = (1, 2))
+        b = (connectivity*num_points)*uniform(low = 0, high = 1, size = (1, 2))
         w = np.argmin(np.sum((a-b)**2, 1))
         n = a[w, :]
         k = np.arctan2(b[0][1]-n[1], b[0][0]-n[0])
@@ -59,33 +102,100 @@ def RRT(num_points, connectivity, starting_point, seed):
     return points
 
 
+def _RRT_fast(samples, starting_point, block_size = 128):
+    """ RRT() with precomputed samples, the samples are processed in blocks. Each block is queried at once against
+    a set of static cKDTrees holding all earlier nodes (logarithmic method, tree sizes are decreasing so there
+    are O(log N) trees), the nodes added inside the current block are scanned directly.
+    Candidates are compared with the same squared distance expression as RRT() and ties go to the lowest index,
+    so the result is identical to the brute force argmin.
+    """
+    N = len(samples)+1
+    a = np.multiply(np.ones((N, 2)), starting_point)
+    points = np.zeros((N, 2))
+    points[0] = starting_point
+    trees = [(0, 1, cKDTree(a[0:1]))] #(start, stop, tree) covering contiguous rows of a
+
+    start = 1
+    while start < N:
+        stop = min(start+block_size, N)
+        B = samples[start-1:stop-1]
+        static_d, static_w = _query_trees(trees, a, B)
+
+        for j, b in enumerate(B):
+            i = start+j
+            w = static_w[j]
+            if i > start:
+                d = np.sum((a[start:i]-b)**2, 1)
+                m = np.argmin(d)
+                if d[m] < static_d[j]: #static nodes have lower indices and win ties
+                    w = start+m
+            n = a[w, :]
+            k = np.arctan2(b[1]-n[1], b[0]-n[0])
+            c = np.array([n[0]+np.cos(k), n[1]+np.sin(k)])
+            a[i, :] = c
+            points[i] = (c[0]+n[0])/2, (c[1]+n[1])/2,
 
-def connect_RRT(points, max_norm):
+        trees.append((start, stop, cKDTree(a[start:stop])))
+        while len(trees) > 1 and trees[-2][1]-trees[-2][0] <= trees[-1][1]-trees[-1][0]:
+            (s, _, _), (_, e, _) = trees.pop(-2), trees.pop()
+            trees.append((s, e, cKDTree(a[s:e])))
+        start = stop
+
+    return points
+
+
+def _query_trees(trees, a, B, rtol = 1e-9):
+    """ Nearest row of a[0:trees[-1][1]] for every sample in B, returns the squared distances and indices. """
+    candidates = []
+    near_tie = np.zeros(len(B), dtype = bool)
+    for s, e, tree in trees:
+        k = min(2, e-s)
+        d, idx = tree.query(B, k = k)
+        d, idx = d.reshape(len(B), k), idx.reshape(len(B), k)
+        candidates.append(idx[:, 0]+s)
+        if k == 2:
+            near_tie |= d[:, 1]**2 <= d[:, 0]**2*(1+rtol)
+    candidates = np.column_stack(candidates)
+    D = np.sum((a[candidates]-B[:, None, :])**2, 2)
+    d_min = D.min(1)
+    w = np.where(D == d_min[:, None], candidates, len(a)).min(1)
+
+    #the tree distances are not guaranteed to round like the numpy expression, resolve near ties by brute force
+    stop = trees[-1][1]
+    for j in np.flatnonzero(near_tie):
+        d = np.sum((a[0:stop]-B[j])**2, 1)
+        w[j] = np.argmin(d)
+        d_min[j] = d[w[j]]
+    return d_min, w
+
+
+
+def connect_RRT(points, max_norm, remove_intersections = False):
+    """ Connects every node to the lowest indexed earlier node closer than max_norm, i.e. one connection per node.
+    Neighbours come from a KD-tree radius query and the intersection test only runs on connections whose
+    midpoints are close enough for the segments to cross.
+    remove_intersections = True drops the later connection of every crossing pair.
+    """
     connections = [] #store connections [(point1, point1), ..]
     N = len(points[:, 0])
+    #the radius is padded slightly, the exact norm test below decides
+    neighbours = cKDTree(points).query_ball_point(points, max_norm*(1+1e-9))
     for i in range(1, N): #skip starting point
-        iter = 0
-        for j in range(N):
-            if i > j: #only connect from lower to higher index
-                if np.linalg.norm(points[i, :]-points[j, :]) < max_norm:
-                    iter += 1
-                    if iter < 2: #restrict connections in clusters, only 1 brancing allowed
-                        connections.append((j, i))
-
-    # #exclude nodes with intersect connections
-    intersections = []
-    POI = []
-    for i in range(len(connections)):
-        for j in range(len(connections)):
-            if i<j:
-                if connections[i][0] not in connections[j] and connections[i][1] not in connections[j]:
-                    if intersect(points[connections[i][0], :], points[connections[i][1], :], \
-                        points[connections[j][0], :], points[connections[j][1], :]):
-                        intersections.append(j)
+        for j in sorted(neighbours[i]):
+            if j >= i: #only connect from lower to higher index
+                break
+            if np.linalg.norm(points[i, :]-points[j, :]) < max_norm:
+                connections.append((j, i)) #restrict connections in clusters, only 1 brancing allowed
+                break
 
     #exclude nodes without connection
     lines = np.array(connections)
-    # lines = np.delete(lines, intersections, axis = 0)
+    if remove_intersections:
+        #exclude nodes with intersect connections, pairs sharing a node are not counted
+        candidates = np.array(connections, dtype = int).reshape(-1, 2)
+        pairs = intersecting_pairs(points[candidates])
+        shared = np.any(candidates[pairs[:, 0], :, None] == candidates[pairs[:, 1], None, :], (1, 2))
+        lines = np.delete(lines, pairs[~shared, 1], axis = 0)
     # points_removed = []
     # i = 1
     # while i < len(points):
@@ -100,6 +210,18 @@ def connect_RRT(points, max_norm):
     return points, lines
 
 
+def _candidate_pairs(segments):
+    """ Broad phase for the intersection test. Two segments can only cross if their midpoints are closer than
+    the longest segment, returns these pairs (i, j), i < j, in lexicographic order.
+    """
+    if len(segments) < 2:
+        return np.zeros((0, 2), dtype = int)
+    max_length = np.max(np.linalg.norm(segments[:, 1]-segments[:, 0], axis = 1))
+    midpoints = (segments[:, 0]+segments[:, 1])/2
+    pairs = cKDTree(midpoints).query_pairs(max_length*(1+1e-9), output_type = 'ndarray')
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
 def plot_graph(nodes, lines, view = True, annotate = False, save = False):
     fig, ax = plt.subplots()
     ax.scatter(nodes[:, 0], nodes[:, 1], s = 0.1)
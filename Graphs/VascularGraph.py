@@ -0,0 +1,144 @@
+""" Array backed vascular graphs for the boundary conditions of the solver: root (Dirichlet 1) and tips
+(Dirichlet 1/(1+x), x the distance from the root along the graph).
+
+VascularGraph holds one graph or a batch of them as a disjoint union in one CSR adjacency (indptr, indices, the
+edge of every entry), nodes of graph g are node_ptr[g]:node_ptr[g+1] as in the shards of generate_graphs.py.
+A single breadth first traversal from the roots, one vectorized step per level and shared by all graphs of the
+batch, gives for every node:
+    parent        parent node in the tree, -1 for the roots and nodes not connected to a root
+    depth         number of edges from the root, -1 if not connected
+    distance      path length from the root along the graph, inf if not connected
+    children      number of children
+    branch_order  number of branch points (nodes with more than one child) passed on the way from the root
+    segment       first node of the segment (the edges between two branch points, the root or a tip) holding the
+                  edge from the parent, -1 for roots and nodes not connected
+and tips (connected nodes without children, the "tip_i" of box_embed in graphs.jl), segments and
+segment_length. Every edge is visited twice (once per direction), the work is linear in the number of edges.
+connect_RRT joins every node to one earlier node, so its graphs are trees, graphs with cycles raise ValueError.
+
+Usage:
+    graph = VascularGraph(nodes, lines)                           output of connect_RRT, root node 0
+    graph = VascularGraph.batch([(nodes, lines), ...])
+    graph = VascularGraph.from_shard("../Data/graphs/shard_000000.npz")
+    graph.split(graph.distance)[g], graph.tips_of(g)
+"""
+import numpy as np
+
+
+class VascularGraph:
+    def __init__(self, nodes, lines, root = 0, node_ptr = None):
+        """ nodes (N, 2), lines (E, 2) of node indices. For a batch node_ptr (G+1,) delimits the nodes of every
+        graph, lines use the indices into nodes and root holds the root of every graph """
+        self.nodes = np.asarray(nodes, dtype = np.float64)
+        self.lines = np.asarray(lines, dtype = np.int64).reshape(-1, 2)
+        N = len(self.nodes)
+        self.node_ptr = np.array([0, N]) if node_ptr is None else np.asarray(node_ptr, dtype = np.int64)
+        self.roots = np.atleast_1d(np.asarray(root, dtype = np.int64))
+        self.graph = np.repeat(np.arange(self.num_graphs), np.diff(self.node_ptr))
+        self.length = np.linalg.norm(self.nodes[self.lines[:, 1]]-self.nodes[self.lines[:, 0]], axis = 1)
+
+        #both directions of every line, grouped by the source node
+        source = np.concatenate((self.lines[:, 0], self.lines[:, 1]))
+        order = np.argsort(source, kind = 'stable')
+        self.indptr = np.zeros(N+1, dtype = np.int64)
+        np.cumsum(np.bincount(source, minlength = N), out = self.indptr[1:])
+        self.indices = np.concatenate((self.lines[:, 1], self.lines[:, 0]))[order]
+        self.edge = np.concatenate((np.arange(len(self.lines)), np.arange(len(self.lines))))[order]
+        self.traverse()
+
+    @classmethod
+    def batch(cls, graphs):
+        """ One VascularGraph of the (nodes, lines) pairs in graphs, each rooted at its node 0 """
+        nodes = [np.asarray(n) for n, _ in graphs]
+        lines = [np.asarray(l).reshape(-1, 2) for _, l in graphs]
+        node_ptr = np.cumsum([0]+[len(n) for n in nodes])
+        line_ptr = np.cumsum([0]+[len(l) for l in lines])
+        return cls.from_ragged(node_ptr, np.concatenate(nodes), line_ptr, np.concatenate(lines))
+
+    @classmethod
+    def from_ragged(cls, node_ptr, nodes, line_ptr, lines, roots = None):
+        """ Batch from the ragged layout of generate_graphs.py (line indices local to their graph), roots local
+        to their graph as well, default node 0 of every graph """
+        node_ptr = np.asarray(node_ptr, dtype = np.int64)
+        offset = np.repeat(node_ptr[:-1], np.diff(line_ptr))
+        roots = np.zeros(len(node_ptr)-1, dtype = np.int64) if roots is None else np.asarray(roots)
+        return cls(nodes, np.asarray(lines).reshape(-1, 2)+offset[:, None], node_ptr[:-1]+roots, node_ptr)
+
+    @classmethod
+    def from_shard(cls, path):
+        with np.load(path) as shard:
+            return cls.from_ragged(shard["node_ptr"], shard["nodes"], shard["line_ptr"], shard["lines"])
+
+    @property
+    def num_graphs(self):
+        return len(self.node_ptr)-1
+
+    @property
+    def num_nodes(self):
+        return len(self.nodes)
+
+    def traverse(self):
+        """ Breadth first traversal from the roots, fills the per node arrays of the module docstring """
+        N = self.num_nodes
+        self.parent = np.full(N, -1, dtype = np.int64)
+        self.depth = np.full(N, -1, dtype = np.int64)
+        self.distance = np.full(N, np.inf)
+        self.children = np.zeros(N, dtype = np.int64)
+        self.branch_order = np.zeros(N, dtype = np.int64)
+        self.segment = np.full(N, -1, dtype = np.int64)
+        slot = np.zeros(N, dtype = np.int64) #scratch, to keep one parent per newly reached node
+
+        frontier = self.roots
+        self.depth[frontier] = 0
+        self.distance[frontier] = 0
+        while len(frontier):
+            start = self.indptr[frontier]
+            counts = self.indptr[frontier+1]-start
+            #CSR entries of all neighbours of the frontier, and the frontier position they come from
+            source = np.repeat(np.arange(len(frontier)), counts)
+            entry = np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)+np.repeat(start, counts)
+            target = self.indices[entry]
+            new = self.depth[target] < 0
+            source, entry, target = source[new], entry[new], target[new]
+            slot[target] = np.arange(len(target)) #a node reached twice in this level only keeps the last entry
+            keep = slot[target] == np.arange(len(target))
+            source, entry, target = source[keep], entry[keep], target[keep]
+
+            parent = frontier[source]
+            children = np.bincount(source, minlength = len(frontier))
+            self.children[frontier] = children
+            branching = (children > 1)[source]
+            self.parent[target] = parent
+            self.depth[target] = self.depth[parent]+1
+            self.distance[target] = self.distance[parent]+self.length[self.edge[entry]]
+            self.branch_order[target] = self.branch_order[parent]+branching
+            starts = branching | (self.parent[parent] < 0)
+            self.segment[target] = np.where(starts, target, self.segment[parent])
+            frontier = target
+
+        reached = self.depth >= 0
+        tree_edges = reached.sum()-len(self.roots)
+        if np.count_nonzero(reached[self.lines[:, 0]]) != tree_edges:
+            raise ValueError("the graph has cycles, the distances along its traversal tree are not the path lengths")
+        is_root = np.zeros(N, dtype = bool)
+        is_root[self.roots] = True
+        self.tips = np.flatnonzero(reached & (self.children == 0) & ~is_root)
+        self.segments = np.flatnonzero(self.segment == np.arange(N))
+        has_parent = self.parent >= 0
+        edge_length = np.zeros(N)
+        edge_length[has_parent] = self.distance[has_parent]-self.distance[self.parent[has_parent]]
+        self.segment_length = np.bincount(self.segment[has_parent], weights = edge_length[has_parent],
+                                          minlength = N)[self.segments]
+        return self
+
+    def split(self, values, index = None):
+        """ values per node (or per entry of the sorted node index) as a list with one array per graph """
+        index = np.arange(self.num_nodes) if index is None else index
+        bounds = np.searchsorted(index, self.node_ptr)
+        return [values[bounds[g]:bounds[g+1]] for g in range(self.num_graphs)]
+
+    def tips_of(self, g):
+        """ Tips of graph g, local node indices and their distances from the root """
+        bounds = np.searchsorted(self.tips, self.node_ptr[g:g+2])
+        tips = self.tips[bounds[0]:bounds[1]]
+        return tips-self.node_ptr[g], self.distance[tips]
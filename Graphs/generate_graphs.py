@@ -0,0 +1,141 @@
+""" Generates RRT graphs for a range of seeds on a process pool and stores them in sharded .npz files.
+
+Graph k uses the seed first_seed + k and its own np.random.default_rng(seed) stream, so the result does not
+depend on the number of workers or the order the shards finish in. Shard s holds the graphs
+[s*shard_size, (s+1)*shard_size) in a ragged (CSR style) layout:
+    seeds     (G,)        seed of every graph
+    node_ptr  (G+1,)      nodes of graph g are nodes[node_ptr[g]:node_ptr[g+1]]
+    nodes     (sum N, 2)
+    line_ptr  (G+1,)      lines of graph g are lines[line_ptr[g]:line_ptr[g+1]], indices local to the graph
+    lines     (sum E, 2)
+Shards are written to a temporary file and renamed, so a shard on disk is always complete. manifest.json stores
+the generation parameters and the finished shards. Rerunning with the same parameters skips finished shards,
+which resumes a crashed run or appends shards when num_graphs is increased.
+
+Usage: python generate_graphs.py ../Data/graphs --num_graphs 100000 --workers 8
+"""
+import argparse
+import json
+import os
+from multiprocessing import Pool
+import numpy as np
+from RRT import RRT, connect_RRT
+
+PARAMS = ("num_points", "connectivity", "max_norm", "remove_intersections", "first_seed", "shard_size")
+
+
+def generate_graph(seed, num_points, connectivity, max_norm, remove_intersections = False):
+    """ One graph with its own RNG stream, returns nodes (N, 2) and lines (E, 2) """
+    rng = np.random.default_rng(seed)
+    points = RRT(num_points, connectivity, np.array([0, 0]), rng, fast = True)
+    return connect_RRT(points, max_norm, remove_intersections = remove_intersections)
+
+
+def shard_path(out_dir, shard):
+    return os.path.join(out_dir, "shard_{:06d}.npz".format(shard))
+
+
+def _generate_shard(task):
+    """ Pool worker, generates and writes one shard. Returns (shard, number of graphs). """
+    out_dir, shard, seeds, params = task
+    nodes, lines = [], []
+    for seed in seeds:
+        n, l = generate_graph(seed, params["num_points"], params["connectivity"], params["max_norm"],
+                              params["remove_intersections"])
+        nodes.append(n)
+        lines.append(l.reshape(-1, 2))
+
+    tmp = shard_path(out_dir, shard)+".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, seeds = np.asarray(seeds, dtype = np.int64),
+                 node_ptr = np.cumsum([0]+[len(n) for n in nodes]),
+                 nodes = np.concatenate(nodes).astype(np.float64),
+                 line_ptr = np.cumsum([0]+[len(l) for l in lines]),
+                 lines = np.concatenate(lines).astype(np.int32))
+    os.replace(tmp, shard_path(out_dir, shard))
+    return shard, len(seeds)
+
+
+def _write_manifest(out_dir, manifest):
+    tmp = os.path.join(out_dir, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(tmp, os.path.join(out_dir, "manifest.json"))
+
+
+def _read_shard_size(path):
+    with np.load(path) as shard:
+        return len(shard["seeds"])
+
+
+def generate_dataset(out_dir, num_graphs, num_points = 30, connectivity = 1.0, max_norm = 1.0,
+                     remove_intersections = False, first_seed = 0, shard_size = 1000, workers = None):
+    """ Generates graphs first_seed, .., first_seed+num_graphs-1 into out_dir, see the module docstring.
+    Raises ValueError if out_dir holds a dataset generated with other parameters. A rerun with fewer graphs drops
+    the shards past the new end from the manifest (their files stay and are reused if the dataset grows again).
+    """
+    os.makedirs(out_dir, exist_ok = True)
+    params = dict(num_points = num_points, connectivity = connectivity, max_norm = max_norm,
+                  remove_intersections = remove_intersections, first_seed = first_seed, shard_size = shard_size)
+
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["params"] != params:
+            raise ValueError("{} was generated with {}, got {}".format(out_dir, manifest["params"], params))
+    else:
+        manifest = {"params": params, "shards": {}}
+
+    num_shards = -(-num_graphs//shard_size)
+    for shard in [s for s in manifest["shards"] if int(s) >= num_shards]:
+        manifest["shards"].pop(shard)
+    tasks = []
+    for shard in range(num_shards):
+        seeds = list(range(first_seed+shard*shard_size, first_seed+min((shard+1)*shard_size, num_graphs)))
+        path = shard_path(out_dir, shard)
+        #the shard file is the ground truth, the manifest may be behind after a crash
+        if os.path.exists(path) and _read_shard_size(path) == len(seeds):
+            manifest["shards"][str(shard)] = len(seeds)
+            continue
+        manifest["shards"].pop(str(shard), None)
+        tasks.append((out_dir, shard, seeds, params))
+    _write_manifest(out_dir, manifest)
+
+    with Pool(workers) as pool:
+        for i, (shard, n) in enumerate(pool.imap_unordered(_generate_shard, tasks)):
+            manifest["shards"][str(shard)] = n
+            _write_manifest(out_dir, manifest)
+            print("shard {} done ({}/{})".format(shard, i+1, len(tasks)))
+
+    manifest["num_graphs"] = sum(manifest["shards"].values())
+    _write_manifest(out_dir, manifest)
+    return manifest
+
+
+def load_graphs(out_dir):
+    """ Iterates over (seed, nodes, lines) of all finished shards in seed order """
+    with open(os.path.join(out_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    for shard in sorted(manifest["shards"], key = int):
+        with np.load(shard_path(out_dir, int(shard))) as s:
+            seeds, node_ptr, nodes, line_ptr, lines = s["seeds"], s["node_ptr"], s["nodes"], s["line_ptr"], s["lines"]
+        for g, seed in enumerate(seeds):
+            yield seed, nodes[node_ptr[g]:node_ptr[g+1]], lines[line_ptr[g]:line_ptr[g+1]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Generate RRT graphs in parallel into sharded .npz files")
+    parser.add_argument("out_dir")
+    parser.add_argument("--num_graphs", type = int, default = 10000)
+    parser.add_argument("--num_points", type = int, default = 30)
+    parser.add_argument("--connectivity", type = float, default = 1.0)
+    parser.add_argument("--max_norm", type = float, default = 1.0)
+    parser.add_argument("--remove_intersections", action = "store_true")
+    parser.add_argument("--first_seed", type = int, default = 0)
+    parser.add_argument("--shard_size", type = int, default = 1000)
+    parser.add_argument("--workers", type = int, default = None, help = "default: number of cores")
+    args = parser.parse_args()
+
+    generate_dataset(args.out_dir, args.num_graphs, args.num_points, args.connectivity, args.max_norm,
+                     args.remove_intersections, args.first_seed, args.shard_size, args.workers)
@@ -0,0 +1,161 @@
+""" Training targets without gmsh and Gridap: the coupled 2D/1D problem of Solver/solver.jl discretized directly on
+the 128x128 image grid of the binary masks (rasterize.py).
+
+Every pixel of [-padding, 1+padding]^2 is a finite volume cell of the tissue (5-point Laplacian, zero Neumann on
+the walls), the cells the graph passes through also carry the 1D diffusion along the graph: consecutive cells
+of every edge (segment_cells) are linked with conductance kappa_graph*links/length, so the resistance of an
+edge is its true length whatever staircase it is rasterized to. As in solver.jl u = u_hat on the graph, the
+root cell is fixed to 1 and every tip cell to 1/(1+x), x the distance from the root along the graph
+(VascularGraph), all sources are zero. Nodes are normalized by their maximum like connect_RRT in RRT.jl.
+The result is the cell center value, the same sampling as interpolate.jl.
+
+The 2D stencil is assembled once per GridSolver and reused for every graph, only the graph links and the
+Dirichlet rows are added. The Dirichlet cells are eliminated, the remaining system is symmetric positive
+definite and factorized by SuperLU with a minimum degree ordering of A+A^T in symmetric mode (about half
+the fill and time of the default column ordering on this grid). The factorization itself changes with every
+graph and cannot be shared. solve_graphs runs on a process pool with one GridSolver per worker.
+
+Usage: python grid_solver.py ../Data/graphs ../Data --workers 8    masks and targets of a generate_graphs.py dataset
+"""
+import argparse
+import os
+from multiprocessing import Pool
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+from rasterize import binary_masks, segment_cells
+from VascularGraph import VascularGraph
+from generate_graphs import load_graphs
+
+
+def dirichlet_value(distance):
+    """ Tip value of solver.jl for the distance from the root along the graph """
+    return 1/(1+distance)
+
+
+class GridSolver:
+    def __init__(self, padding = 0.01, partition = (128, 128), kappa = 1.0, kappa_graph = 1.0):
+        self.partition = tuple(partition)
+        self.lo, self.hi = -padding, 1.0+padding
+        self.h = (self.hi-self.lo)/np.array(partition)
+        self.kappa_graph = kappa_graph
+        nx, ny = partition
+        cell = np.arange(nx*ny).reshape(nx, ny)
+        #one entry per face between two cells, conductance kappa*face/distance
+        self.face_i = np.concatenate((cell[:-1, :].ravel(), cell[:, :-1].ravel()))
+        self.face_j = np.concatenate((cell[1:, :].ravel(), cell[:, 1:].ravel()))
+        self.face_c = np.concatenate((np.full((nx-1)*ny, kappa*self.h[1]/self.h[0]),
+                                      np.full(nx*(ny-1), kappa*self.h[0]/self.h[1])))
+
+    def cell(self, points):
+        """ Flat index of the cell holding every point """
+        ij = np.clip(np.floor((points-self.lo)/self.h).astype(int), 0, np.array(self.partition)-1)
+        return ij[:, 0]*self.partition[1]+ij[:, 1]
+
+    def graph_links(self, nodes, lines, lengths):
+        """ Pairs of cells linked along the graph and their conductances """
+        seg, sx, sy = segment_cells(nodes[lines[:, 0]], nodes[lines[:, 1]], self.lo, self.hi, self.partition)
+        cells = sx*self.partition[1]+sy
+        link = (seg[1:] == seg[:-1]) & (cells[1:] != cells[:-1])
+        seg, i, j = seg[1:][link], cells[:-1][link], cells[1:][link]
+        links = np.bincount(seg, minlength = len(lines))
+        return i, j, self.kappa_graph*links[seg]/lengths[seg]
+
+    def dirichlet(self, graph):
+        """ Dirichlet cells and values, the root wins a cell it shares with tips, tips sharing a cell average """
+        tips = self.cell(graph.nodes[graph.tips])
+        cells, inverse = np.unique(tips, return_inverse = True)
+        values = np.bincount(inverse, weights = dirichlet_value(graph.distance[graph.tips]))/np.bincount(inverse)
+        root = self.cell(graph.nodes[graph.roots])
+        keep = cells != root[0]
+        return np.concatenate((root, cells[keep])), np.concatenate(([1.0], values[keep]))
+
+    def solve(self, nodes, lines):
+        """ Solution on the grid (partition) for one graph, nodes (N, 2) and lines (E, 2) from connect_RRT """
+        nodes = np.asarray(nodes, dtype = np.float64)
+        nodes = nodes/np.max(nodes)
+        lines = np.asarray(lines, dtype = int).reshape(-1, 2)
+        graph = VascularGraph(nodes, lines)
+        fixed, values = self.dirichlet(graph)
+        gi, gj, gc = self.graph_links(nodes, lines, graph.length)
+
+        n = self.partition[0]*self.partition[1]
+        i, j, c = np.concatenate((self.face_i, gi)), np.concatenate((self.face_j, gj)), np.concatenate((self.face_c, gc))
+        u = np.zeros(n)
+        u[fixed] = values
+        free = np.ones(n, dtype = bool)
+        free[fixed] = False
+        number = np.cumsum(free)-1 #index of every free cell in the reduced system
+
+        #symmetric assembly of the conductances, fixed neighbours go to the right hand side
+        diagonal = np.bincount(i, weights = c, minlength = n)+np.bincount(j, weights = c, minlength = n)
+        rhs = np.bincount(i, weights = c*u[j], minlength = n)+np.bincount(j, weights = c*u[i], minlength = n)
+        both = free[i] & free[j]
+        rows = np.concatenate((number[i[both]], number[j[both]], number[free]))
+        cols = np.concatenate((number[j[both]], number[i[both]], number[free]))
+        data = np.concatenate((-c[both], -c[both], diagonal[free]))
+        m = free.sum()
+        A = sp.csc_matrix((data, (rows, cols)), shape = (m, m))
+        lu = splu(A, permc_spec = 'MMD_AT_PLUS_A', options = dict(SymmetricMode = True))
+        u[free] = lu.solve(rhs[free])
+        return u.reshape(self.partition)
+
+
+_solver = None
+
+
+def _init_worker(kwargs):
+    global _solver
+    _solver = GridSolver(**kwargs)
+
+
+def _solve(graph):
+    return _solver.solve(*graph)
+
+
+def solve_graphs(graphs, workers = None, chunksize = 16, **kwargs):
+    """ Solutions (B, partition) for a list of (nodes, lines), kwargs go to GridSolver. workers = 0 solves in this
+    process. """
+    if workers == 0:
+        solver = GridSolver(**kwargs)
+        return np.array([solver.solve(*g) for g in graphs])
+    with Pool(workers, initializer = _init_worker, initargs = (kwargs,)) as pool:
+        return np.array(pool.map(_solve, graphs, chunksize = chunksize))
+
+
+def relative_error(solutions, targets):
+    """ Relative L2 and max error per sample, e.g. against the Gridap targets of the same graphs """
+    difference = (solutions-targets).reshape(len(targets), -1)
+    return np.linalg.norm(difference, axis = 1)/np.linalg.norm(targets.reshape(len(targets), -1), axis = 1), \
+        np.abs(difference).max(1)
+
+
+def write_dataset(graph_dir, out_dir, suffix = "10k", workers = None, chunk = 1000, padding = 0.01,
+                  partition = (128, 128)):
+    """ input_images_<suffix>.npy (binary masks) and target_images_<suffix>.npy (solutions) of all graphs of a
+    generate_graphs.py dataset, chunk graphs at a time """
+    graphs = [(nodes, lines) for _, nodes, lines in load_graphs(graph_dir)]
+    shape = (len(graphs), *partition)
+    masks = np.lib.format.open_memmap(os.path.join(out_dir, "input_images_{}.npy".format(suffix)), mode = 'w+',
+                                      dtype = np.float64, shape = shape)
+    targets = np.lib.format.open_memmap(os.path.join(out_dir, "target_images_{}.npy".format(suffix)), mode = 'w+',
+                                        dtype = np.float64, shape = shape)
+    for start in range(0, len(graphs), chunk):
+        batch = graphs[start:start+chunk]
+        masks[start:start+chunk] = binary_masks(batch, padding, partition)
+        targets[start:start+chunk] = solve_graphs(batch, workers, padding = padding, partition = partition)
+        print("{}/{} samples".format(min(start+chunk, len(graphs)), len(graphs)))
+    masks.flush()
+    targets.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Binary masks and grid solver targets of a graph dataset")
+    parser.add_argument("graph_dir", help = "output folder of generate_graphs.py")
+    parser.add_argument("out_dir")
+    parser.add_argument("--suffix", default = "10k")
+    parser.add_argument("--workers", type = int, default = None, help = "default: number of cores")
+    parser.add_argument("--padding", type = float, default = 0.01)
+    args = parser.parse_args()
+
+    write_dataset(args.graph_dir, args.out_dir, args.suffix, args.workers, padding = args.padding)
@@ -0,0 +1,118 @@
+""" Binary masks of graphs, the Python counterpart of Solver/binary_mask.jl.
+
+binary_mask.jl samples more and more points along every edge and recomputes a np.histogram2d until the mask stops
+changing. Here every edge is rasterized directly: the cells an edge passes through (its supercover) are found
+from the parameters t where the edge crosses a grid line, sorting all crossings of all edges at once and taking
+the cell of the midpoint between consecutive crossings. The cost is fixed per covered cell and there is no
+refinement loop.
+
+The grid follows the static padding convention of binary_mask.jl: nodes are normalized by their maximum, the
+grid covers [-padding, 1+padding] in both directions with mask[i, j] the cell of x-bin i and y-bin j, and the
+two corner cells holding the fictive nodes are cleared.
+"""
+import numpy as np
+
+
+def binary_mask(nodes, lines, padding = 0.01, partition = (128, 128), normalize = True, dtype = np.float64):
+    """ Binary mask of one graph, nodes (N, 2) and lines (E, 2) as returned by connect_RRT """
+    return binary_masks([(nodes, lines)], padding, partition, normalize, dtype)[0]
+
+
+def binary_masks(graphs, padding = 0.01, partition = (128, 128), normalize = True, dtype = np.float64):
+    """ Binary masks (B, partition[0], partition[1]) for a list of (nodes, lines) graphs, all edges of all graphs
+    are rasterized in one pass. """
+    nx, ny = partition
+    lo, hi = -padding, 1.0+padding
+
+    nodes, p, q, node_graph, line_graph = [], [], [], [], []
+    for g, (n, l) in enumerate(graphs):
+        n = np.asarray(n, dtype = np.float64)
+        l = np.asarray(l, dtype = int).reshape(-1, 2)
+        if normalize:
+            n = n/np.max(n)
+        nodes.append(n)
+        p.append(n[l[:, 0]])
+        q.append(n[l[:, 1]])
+        node_graph.append(np.full(len(n), g))
+        line_graph.append(np.full(len(l), g))
+    nodes, p, q = np.concatenate(nodes), np.concatenate(p), np.concatenate(q)
+    node_graph, line_graph = np.concatenate(node_graph), np.concatenate(line_graph)
+
+    #nodes are binned like np.histogram2d, edge interiors by the supercover
+    ix, iy = _histogram_bins(nodes[:, 0], lo, hi, nx), _histogram_bins(nodes[:, 1], lo, hi, ny)
+    seg, sx, sy = segment_cells(p, q, lo, hi, partition)
+    g = np.concatenate([node_graph, line_graph[seg]])
+    ix, iy = np.concatenate([ix, sx]), np.concatenate([iy, sy])
+
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    masks = np.zeros((len(graphs), nx, ny), dtype = dtype)
+    masks[g[inside], ix[inside], iy[inside]] = 1
+    #binary_mask.jl removes its fictive nodes by clearing these corners
+    masks[:, 0, 0] = 0
+    masks[:, -1, -1] = 0
+    return masks
+
+
+def segment_cells(p, q, lo, hi, partition):
+    """ Cells passed by the segments p[s]-q[s] on the grid [lo, hi]^2 with the given partition.
+    Returns the segment index and the x/y cell indices of every covered cell, ordered along each segment from
+    p to q (consecutive entries of a segment may repeat a cell). Cells may be outside the grid. """
+    n = np.array(partition)
+    h = (hi-lo)/n
+    a = (p-lo)/h #grid coordinates
+    b = (q-lo)/h
+    S = len(a)
+
+    #integer grid lines strictly between the endpoints, per axis
+    first = np.floor(np.minimum(a, b)).astype(int)+1
+    count = np.maximum(np.ceil(np.maximum(a, b)).astype(int)-first, 0)
+    seg, t = [np.arange(S), np.arange(S)], [np.zeros(S), np.ones(S)]
+    for axis in range(2):
+        c = count[:, axis]
+        s = np.repeat(np.arange(S), c)
+        k = first[s, axis]+np.arange(c.sum())-np.repeat(np.cumsum(c)-c, c)
+        seg.append(s)
+        t.append((k-a[s, axis])/(b[s, axis]-a[s, axis]))
+    seg, t = np.concatenate(seg), np.concatenate(t)
+    order = np.lexsort((t, seg))
+    seg, t = seg[order], t[order]
+
+    #midpoints between consecutive crossings of the same segment lie inside a covered cell
+    same = (seg[1:] == seg[:-1]) & (t[1:] > t[:-1])
+    seg = seg[1:][same]
+    t_mid = ((t[1:]+t[:-1])/2)[same]
+    cells = np.floor(a[seg]+t_mid[:, None]*(b[seg]-a[seg])).astype(int)
+    return seg, cells[:, 0], cells[:, 1]
+
+
+def _histogram_bins(v, lo, hi, n):
+    """ Bin index as in np.histogram2d with range (lo, hi), the right edge belongs to the last bin """
+    edges = np.linspace(lo, hi, n+1)
+    i = np.searchsorted(edges, v, side = "right")-1
+    i[v == hi] = n-1
+    i[(v < lo) | (v > hi)] = -1
+    return i
+
+
+if __name__ == "__main__":
+    #compare against the histogram approach of binary_mask.jl with many points per edge
+    import time
+    from RRT import RRT, connect_RRT
+
+    graphs = [connect_RRT(RRT(30, 1, np.array([0, 0]), seed, fast = True), 1) for seed in range(1, 201)]
+    t_0 = time.perf_counter()
+    masks = binary_masks(graphs)
+    print("rasterized {} graphs in {:.4f} s".format(len(graphs), time.perf_counter()-t_0))
+
+    #the dense sampling can only miss thin corners of cells that an edge clips, it never adds cells
+    missed, extra = 0, 0
+    for (nodes, lines), mask in zip(graphs, masks):
+        nodes = nodes/np.max(nodes)
+        t = np.linspace(0, 1, 2000)[:, None, None]
+        x = np.concatenate([nodes, (nodes[lines[:, 0]]+t*(nodes[lines[:, 1]]-nodes[lines[:, 0]])).reshape(-1, 2)])
+        x = np.concatenate([x, [[1.01, 1.01], [-0.01, -0.01]]])
+        M = np.histogram2d(x[:, 0], x[:, 1], 128)[0]
+        M[0, 0] = M[-1, -1] = 0
+        missed += np.sum((M == 0) & (mask == 1))
+        extra += np.sum((M > 0) & (mask == 0))
+    print("pixels missed by the dense histogram: {}, pixels missing in the mask: {}".format(missed, extra))